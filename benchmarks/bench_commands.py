@@ -0,0 +1,130 @@
+"""Benchmark `ph` commands against the local stub API.
+
+For every flag count, starts benchmarks/stub_server.py in-process, runs each
+command in a fresh `ph` process (with its own HOME so the user's credentials
+and caches are never touched) and reports wall time, HTTP requests and bytes
+transferred as seen by the server.
+
+    python benchmarks/bench_commands.py --flags 10,1000,10000 --latency-ms 20 --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_server import TOKEN, start_server  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY = "import sys; from ph.main import main; sys.argv = ['ph'] + sys.argv[1:]; main()"
+
+# (name, args); every command runs against a freshly started server
+COMMANDS = [
+    ('list', ['flags', 'list', '--no-interactive', '-f', 'ndjson']),
+    ('show', ['flags', 'show', 'flag-1']),
+    ('disable', ['flags', 'disable', 'flag-1']),
+    ('enable', ['flags', 'enable', 'flag-1']),
+    ('update', ['flags', 'update', 'flag-1', '-p', '50']),
+    ('create', ['flags', 'create', 'bench-flag', '-p', '10']),
+    ('delete', ['flags', 'delete', 'flag-2']),
+    ('sync', ['flags', 'sync']),
+    ('bulk-disable', ['flags', 'disable', '--match', 'flag-1*', '--parallel', '8']),
+]
+
+
+def ph_env(home, port):
+    env = dict(os.environ)
+    env.update({
+        'HOME': home,
+        'PH_ENDPOINT': '127.0.0.1',
+        'PH_API_PROTOCOL_WEB': 'http',
+        'PH_API_PORT_WEB': str(port),
+        'PH_API_TOKEN': TOKEN,
+        'PH_LOG_LEVEL': 'WARNING',
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+    })
+    return env
+
+
+def write_credentials(home, project_id=1):
+    os.makedirs(os.path.join(home, '.posthog'), exist_ok=True)
+    with open(os.path.join(home, '.posthog', 'credentials.json'), 'w') as file:
+        json.dump({"credentials": {"127.0.0.1": {"token": TOKEN, "organization": "stub", "project": project_id}}}, file)
+
+
+def request_stats(port, path):
+    from urllib.request import Request, urlopen
+    method = 'POST' if path == '/_reset' else 'GET'
+    with urlopen(Request(f"http://127.0.0.1:{port}{path}", method=method)) as response:
+        return json.loads(response.read())
+
+
+def run_command(args, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', ENTRY] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def bench(flag_count, latency_ms, runs, warm):
+    rows = []
+    for name, args in COMMANDS:
+        samples, stats = [], None
+        for _ in range(runs):
+            server, state = start_server(0, flag_count, 1, latency_ms)
+            port = server.server_port
+            home = tempfile.mkdtemp()
+            write_credentials(home)
+            env = ph_env(home, port)
+            if warm:
+                # Fill local caches (flag index, snapshot) like a user who has run ph before
+                subprocess.run([sys.executable, '-c', ENTRY, 'flags', 'list', '--no-interactive'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+            state.reset_stats()
+            elapsed, result = run_command(args, env)
+            stats = dict(state.stats)
+            server.shutdown()
+            server.server_close()
+            if result.returncode != 0:
+                print(f"  {name} failed: {result.stderr.strip()}", file=sys.stderr)
+            samples.append(elapsed)
+        rows.append({
+            "flags": flag_count,
+            "command": name,
+            "wall_ms": round(statistics.median(samples), 1),
+            "requests": stats["requests"],
+            "bytes_in": stats["bytes_in"],
+            "bytes_out": stats["bytes_out"],
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--flags', default='10,1000,10000', help='Comma separated flag counts')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency added by the stub to every request')
+    parser.add_argument('--runs', type=int, default=1, help='Runs per command, the median wall time is reported')
+    parser.add_argument('--warm', action='store_true',
+                        help='Populate local caches before each measured command')
+    parser.add_argument('--json', dest='json_path', default=None, help='Also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'flags':>6}  {'command':<14} {'wall ms':>9} {'requests':>9} {'bytes out':>11} {'bytes in':>9}")
+    for flag_count in [int(count) for count in args.flags.split(',')]:
+        for row in bench(flag_count, args.latency_ms, args.runs, args.warm):
+            results.append(row)
+            print(f"{row['flags']:>6}  {row['command']:<14} {row['wall_ms']:>9.1f} {row['requests']:>9} "
+                  f"{row['bytes_out']:>11} {row['bytes_in']:>9}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
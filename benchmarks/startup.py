@@ -0,0 +1,95 @@
+"""Startup time benchmark for the `ph` CLI.
+
+Runs `ph --help`, `ph logout` and a flag key completion in fresh interpreters, reports the median
+wall time over a bare `python -c pass` and the heaviest imports (from
+`python -X importtime`), and fails when that overhead goes over the threshold
+or a heavy module is imported.
+
+    python benchmarks/startup.py --runs 20 --max-ms 100
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ENTRY = "import sys; from ph.main import main; sys.argv = ['ph'] + sys.argv[1:]; main()"
+COMPLETION_ENV = {'_PH_COMPLETE': 'bash_complete', 'COMP_WORDS': 'ph flags show ', 'COMP_CWORD': '3'}
+# (name, arguments, extra environment)
+COMMANDS = [
+    ('ph --help', ['--help'], {}),
+    ('ph logout', ['logout'], {}),
+    ('ph flags show <TAB>', [], COMPLETION_ENV),
+]
+# Modules that must only be imported by the commands that use them
+HEAVY_MODULES = ['requests', 'inquirer', 'rich', 'webbrowser']
+
+
+def run_once(args, env, code=ENTRY):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        sys.exit(f"ph {' '.join(args)} failed:\n{result.stderr}")
+    return elapsed
+
+
+def import_times(args, env):
+    """Parse `-X importtime` output into (cumulative_us, module) for top-level imports."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', ENTRY] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = [part.strip() for part in line[len('import time:'):].split('|')]
+        times.append((int(cumulative), module))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=float(os.environ.get('PH_STARTUP_MAX_MS', 100)),
+                        help='Fail when the median time over a bare interpreter is above this')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to show')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Keep the benchmark away from the user's real credentials
+    env['HOME'] = tempfile.mkdtemp()
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                      env.get('PYTHONPATH')]))
+
+    interpreter = statistics.median(run_once([], env, 'pass') for _ in range(args.runs))
+    print(f"python -c pass: median {interpreter:.1f} ms")
+
+    failed = False
+    for name, command, extra_env in COMMANDS:
+        command_env = dict(env, **extra_env)
+        run_once(command, command_env)  # warm the filesystem and bytecode caches
+        samples = [run_once(command, command_env) for _ in range(args.runs)]
+        median = statistics.median(samples)
+        overhead = median - interpreter
+        print(f"{name}: median {median:.1f} ms (+{overhead:.1f} ms), min {min(samples):.1f} ms, max {max(samples):.1f} ms")
+
+        times = import_times(command, command_env)
+        heavy = sorted({module.split('.')[0] for _, module in times} & set(HEAVY_MODULES))
+        for cumulative, module in sorted(times, reverse=True)[:args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {module}")
+
+        if heavy:
+            print(f"  FAIL: imports {', '.join(heavy)}")
+            failed = True
+        if overhead > args.max_ms:
+            print(f"  FAIL: {overhead:.1f} ms over the interpreter is above {args.max_ms:.0f} ms")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""Local stand-in for the PostHog API endpoints used by the CLI.
+
+Serves organizations, projects, paginated feature flags (list/search/
+create/update/soft delete, ETags), gzipped event batches (/batch/),
+paged HogQL results, persons and cohort
+members (offset pages) and the CLI login flow, with a
+configurable number of flags, added latency, injected 503s and 429
+throttling. Request count, bytes
+transferred and captured events are available from GET /_stats and reset
+with POST /_reset.
+
+    python benchmarks/stub_server.py --port 8010 --flags 1000 --latency-ms 20
+    PH_ENDPOINT=127.0.0.1 PH_API_PROTOCOL_WEB=http PH_API_PORT_WEB=8010 PH_API_TOKEN=stub ph flags list
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+ORGANIZATION_ID = "0188a0b1-0000-0000-0000-000000000001"
+TOKEN = "stub-token"
+PROJECT_API_KEY = "phc_stub"
+QUERY_ROWS = 25000
+PERSONS = 20000
+QUERY_COLUMNS = [["event", "String"], ["distinct_id", "String"], ["timestamp", "DateTime64(6, 'UTC')"],
+                 ["n", "Int64"], ["properties", "String"]]
+
+
+def timestamp(offset_seconds=0):
+    moment = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=offset_seconds)
+    return moment.isoformat().replace('+00:00', 'Z')
+
+
+def make_flag(flag_id, key, rollout_percentage=100, updated_offset=0):
+    return {
+        "id": flag_id,
+        "key": key,
+        "name": f"Stub flag {key}",
+        "filters": {
+            "groups": [{"properties": [], "rollout_percentage": rollout_percentage, "variant": None}],
+            "multivariate": None,
+            "payloads": {},
+        },
+        "deleted": False,
+        "active": True,
+        "created_by": None,
+        "created_at": timestamp(updated_offset),
+        "updated_at": timestamp(updated_offset),
+        "version": 1,
+        "is_simple_flag": True,
+        "rollout_percentage": None,
+        "ensure_experience_continuity": False,
+        "experiment_set": [],
+        "features": [],
+        "rollback_conditions": [],
+        "surveys": [],
+        "performed_rollback": False,
+        "can_edit": True,
+        "tags": ["stub"] if flag_id % 10 == 0 else [],
+    }
+
+
+class StubState:
+    """Flags per project plus request statistics, shared by all handler threads."""
+
+    def __init__(self, flags=10, projects=1, latency_ms=0, error_rate=0, throttle_rps=0):
+        self.lock = threading.RLock()
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+        self.window = (0, 0)
+        self.projects = {project_id: {} for project_id in range(1, projects + 1)}
+        self.next_id = 1
+        self.clock = flags
+        for project_id in self.projects:
+            for i in range(flags):
+                self._add(project_id, make_flag(self.next_id, f"flag-{i}", updated_offset=i))
+        self.reset_stats()
+
+    def _add(self, project_id, flag):
+        self.projects[project_id][flag["id"]] = flag
+        self.next_id = max(self.next_id, flag["id"]) + 1
+
+    def throttled(self):
+        """True when more than throttle_rps requests arrived in the current second."""
+        if not self.throttle_rps:
+            return False
+        with self.lock:
+            second, count = self.window
+            now = int(time.time())
+            count = count + 1 if now == second else 1
+            self.window = (now, count)
+            return count > self.throttle_rps
+
+    def tick(self):
+        self.clock += 1
+        return timestamp(self.clock)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "bytes_in": 0, "bytes_out": 0, "by_route": {}, "events": 0}
+
+    def record(self, route, bytes_in, bytes_out):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += bytes_out
+            self.stats["by_route"][route] = self.stats["by_route"].get(route, 0) + 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment, otherwise Nagle + delayed ACK add ~40ms to responses
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # Routing
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        self.bytes_in = len(raw) + len(str(self.headers))
+        if raw and self.headers.get('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        try:
+            self.body = json.loads(raw) if raw and 'json' in (self.headers.get('Content-Type') or 'json') else {}
+        except ValueError:
+            return self._send(400, {"detail": "Invalid JSON"})
+
+        path = url.path.rstrip('/')
+        if path == '/_stats':
+            return self._send_raw(200, json.dumps(self.state.stats).encode(), count=False)
+        if path == '/_reset':
+            self.state.reset_stats()
+            return self._send_raw(200, b'{}', count=False)
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.throttled():
+            self.route = "throttled"
+            return self._send(429, {"detail": "Request was throttled."}, headers={'Retry-After': '1'})
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            self.route = "injected error"
+            return self._send(503, {"detail": "Service unavailable"})
+
+        routes = [
+            ('POST', r'/api/login/cli/start', self.login_start, False),
+            ('GET', r'/api/login/cli/check', self.login_check, False),
+            ('GET', r'/api/organizations', self.organizations, True),
+            ('GET', r'/api/organizations/(?P<org>[^/]+)/projects', self.organization_projects, True),
+            ('GET', r'/api/projects/(?P<project>\d+)', self.get_project, True),
+            ('POST', r'/batch', self.capture_batch, False),
+            ('POST', r'/api/projects/(?P<project>\d+)/query', self.hogql_query, True),
+            ('GET', r'/api/projects/(?P<project>\d+)/persons', self.list_persons, True),
+            ('GET', r'/api/projects/(?P<project>\d+)/cohorts/(?P<cohort>\d+)/persons', self.list_persons, True),
+            ('GET', r'/api/projects/(?P<project>\d+)/feature_flags', self.list_flags, True),
+            ('POST', r'/api/projects/(?P<project>\d+)/feature_flags', self.create_flag, True),
+            ('GET', r'/api/projects/(?P<project>\d+)/feature_flags/(?P<flag>\d+)', self.get_flag, True),
+            ('PATCH', r'/api/projects/(?P<project>\d+)/feature_flags/(?P<flag>\d+)', self.update_flag, True),
+        ]
+        for route_method, pattern, handler, authenticated in routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                self.route = f"{method} {pattern}"
+                if authenticated and self.headers.get('Authorization') != f"Bearer {TOKEN}":
+                    return self._send(401, {"detail": "Invalid token"})
+                return handler(**match.groupdict())
+        self.route = f"{method} unknown"
+        self._send(404, {"detail": "Not found"})
+
+    # Responses
+
+    def _send(self, status, data, headers=None):
+        self._send_raw(status, json.dumps(data).encode(), headers=headers)
+
+    def _send_raw(self, status, body, headers=None, count=True):
+        if status == 304:
+            body = b''
+        elif count and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, compresslevel=5)
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.state.record(getattr(self, 'route', 'unknown'), self.bytes_in, len(body))
+
+    def _project(self, project):
+        flags = self.state.projects.get(int(project))
+        if flags is None:
+            self._send(404, {"detail": "Project not found"})
+        return flags
+
+    # Endpoints
+
+    def login_start(self):
+        self._send(200, {"code": "stub-code"})
+
+    def login_check(self):
+        self._send(200, {"status": "authenticated", "access_token": TOKEN})
+
+    def organizations(self):
+        self._send(200, {"count": 1, "next": None, "previous": None,
+                         "results": [{"id": ORGANIZATION_ID, "name": "Stub organization"}]})
+
+    def organization_projects(self, org):
+        projects = [{"id": project_id, "name": f"Stub project {project_id}", "organization": org}
+                    for project_id in self.state.projects]
+        self._send(200, {"count": len(projects), "next": None, "previous": None, "results": projects})
+
+    def get_project(self, project):
+        if self._project(project) is not None:
+            self._send(200, {"id": int(project), "name": f"Stub project {project}", "api_token": PROJECT_API_KEY})
+
+    def capture_batch(self):
+        if self.body.get("api_key") != PROJECT_API_KEY:
+            return self._send(401, {"detail": "Invalid API key"})
+        batch = self.body.get("batch")
+        if not isinstance(batch, list) or not all(isinstance(event, dict) and event.get("event") for event in batch):
+            return self._send(400, {"detail": "Invalid batch"})
+        with self.state.lock:
+            self.state.stats["events"] += len(batch)
+        self._send(200, {"status": 1})
+
+    def hogql_query(self, project):
+        """Synthetic rows for any query, paged by the LIMIT/OFFSET of the outer SELECT."""
+        if self._project(project) is None:
+            return
+        text = (self.body.get("query") or {}).get("query") or ""
+        limit = re.search(r'LIMIT (\d+)(?: OFFSET (\d+))?\s*$', text)
+        count, offset = (int(limit.group(1)), int(limit.group(2) or 0)) if limit else (100, 0)
+        rows = [[f"event-{n % 7}", f"user-{n % 1000}", timestamp(n), n, json.dumps({"n": n})]
+                for n in range(offset, min(offset + count, QUERY_ROWS))]
+        self._send(200, {"columns": [name for name, _ in QUERY_COLUMNS], "types": QUERY_COLUMNS,
+                         "results": rows, "hasMore": offset + count < QUERY_ROWS})
+
+    def list_persons(self, project, cohort=None):
+        """Synthetic persons; cohort N holds every Nth person."""
+        if self._project(project) is None:
+            return
+        step = int(cohort) if cohort else 1
+        limit = min(int(self.query.get('limit', 100)), 1000)
+        offset = int(self.query.get('offset', 0))
+        ids = range(offset * step, min((offset + limit) * step, PERSONS), step)
+        results = [{"id": n, "uuid": f"00000000-0000-4000-8000-{n:012d}", "distinct_ids": [f"user-{n}"],
+                    "properties": {"email": f"user-{n}@example.com", "plan": "pro" if n % 3 else "free"},
+                    "created_at": timestamp(n)} for n in ids]
+        next_url = None
+        if (offset + limit) * step < PERSONS:
+            query = dict(self.query, limit=limit, offset=offset + limit)
+            next_url = f"http://{self.headers.get('Host')}{urlparse(self.path).path}?{urlencode(query)}"
+        self._send(200, {"next": next_url, "previous": None, "results": results})
+
+    def list_flags(self, project):
+        flags = self._project(project)
+        if flags is None:
+            return
+        with self.state.lock:
+            results = [flag for flag in flags.values() if not flag["deleted"]]
+        search = self.query.get('search')
+        if search:
+            results = [flag for flag in results if search.lower() in flag["key"].lower()
+                       or search.lower() in (flag["name"] or "").lower()]
+        order = self.query.get('order', '-created_at')
+        results.sort(key=lambda flag: flag[order.lstrip('-')] if order.lstrip('-') in flag else flag["id"],
+                     reverse=order.startswith('-'))
+
+        limit = int(self.query.get('limit', 100))
+        offset = int(self.query.get('offset', 0))
+        page = results[offset:offset + limit]
+        next_url = None
+        if offset + limit < len(results):
+            query = dict(self.query, limit=limit, offset=offset + limit)
+            next_url = f"http://{self.headers.get('Host')}{urlparse(self.path).path}?{urlencode(query)}"
+        body = json.dumps({"count": len(results), "next": next_url, "previous": None, "results": page}).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send_raw(304, b'', headers={'ETag': etag})
+        self._send_raw(200, body, headers={'ETag': etag})
+
+    def get_flag(self, project, flag):
+        flags = self._project(project)
+        if flags is None:
+            return
+        current = flags.get(int(flag))
+        if current is None:
+            return self._send(404, {"detail": "Not found"})
+        etag = f'"{current["id"]}-{current["version"]}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send_raw(304, b'', headers={'ETag': etag})
+        self._send(200, current, headers={'ETag': etag})
+
+    def create_flag(self, project):
+        flags = self._project(project)
+        if flags is None:
+            return
+        key = self.body.get("key")
+        with self.state.lock:
+            if not key or any(flag["key"] == key and not flag["deleted"] for flag in flags.values()):
+                return self._send(400, {"type": "validation_error", "detail": "There is already a feature flag with this key."})
+            flag = make_flag(self.state.next_id, key)
+            flag.update({field: value for field, value in self.body.items() if field in flag and field != "id"})
+            flag["created_at"] = flag["updated_at"] = self.state.tick()
+            self.state._add(int(project), flag)
+        self._send(201, flag)
+
+    def update_flag(self, project, flag):
+        flags = self._project(project)
+        if flags is None:
+            return
+        with self.state.lock:
+            current = flags.get(int(flag))
+            if current is None or current["deleted"]:
+                return self._send(404, {"detail": "Not found"})
+            if "version" in self.body and self.body["version"] != current["version"]:
+                return self._send(409, {"type": "conflict", "detail": "The flag was changed by someone else."})
+            for field, value in self.body.items():
+                if field in current and field not in ("id", "created_at", "updated_at", "version"):
+                    current[field] = value
+            current["updated_at"] = self.state.tick()
+            current["version"] += 1
+            flag_data = dict(current)
+        self._send(200, flag_data)
+
+
+def start_server(port=0, flags=10, projects=1, latency_ms=0, error_rate=0, throttle_rps=0):
+    """Start the stub on a background thread. Returns (server, state)."""
+    state = StubState(flags, projects, latency_ms, error_rate, throttle_rps)
+    handler = type('BoundStubHandler', (StubHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--flags', type=int, default=100, help='Flags per project')
+    parser.add_argument('--projects', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added to every API request')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of API requests answered with a 503')
+    parser.add_argument('--throttle-rps', type=int, default=0, help='Answer with 429 + Retry-After above this many requests per second')
+    args = parser.parse_args()
+
+    server, _ = start_server(args.port, args.flags, args.projects, args.latency_ms, args.error_rate, args.throttle_rps)
+    print(f"Stub PostHog API on http://127.0.0.1:{server.server_port} (token: {TOKEN})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,94 +1,505 @@
 import click
 import logging
 import os
+import sys
 
-from ph.utils.flags import create_flag, disable_flag, list_flags, delete_flag, update_flag, show_flag
-from .utils.auth import auth, delete_token_from_file
-from rich.logging import RichHandler
-from rich.console import Console
+# Commands import what they need when they run, so `ph --help` or `ph logout`
+# never load requests, inquirer or rich.
+from .utils.output import FORMATS, set_output_format
 
-console = Console()
 logger = logging.getLogger('ph')
 
-@click.group()
-def main():
+def complete(name):
+    """shell_complete callback that only imports the completion helpers when completing."""
+    def callback(ctx, param, incomplete):
+        from .utils import completion
+        return getattr(completion, name)(ctx, param, incomplete)
+    return callback
+
+class Group(click.Group):
+    """Turns a failed request, already logged where it failed, into exit code 1 instead of a traceback."""
+
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except Exception as e:
+            from .utils.client import APIError
+            if not isinstance(e, APIError):
+                raise
+            logger.debug(f"Command failed: {e}")
+            sys.exit(1)
+
+@click.group(cls=Group)
+@click.option('--trace', 'trace_enabled', is_flag=True, help='Print a timing summary of HTTP calls and local phases at exit (or set PH_TRACE=1)')
+@click.option('--trace-file', type=click.Path(dir_okay=False), default=None, help='Also write a Chrome trace JSON file (or set PH_TRACE=trace.json)')
+@click.option('--output', 'output_format', type=click.Choice(['auto'] + FORMATS), default=None,
+              help='Output format of every command: table on a terminal and ndjson in pipes by default (or set PH_OUTPUT)')
+def main(trace_enabled, trace_file, output_format):
     """Posthog CLI - Hola, Amigo!"""
     setup_logger()
+    set_output_format(output_format)
+    if trace_enabled or trace_file:
+        from .utils import trace
+        trace.enable(trace_file)
 
 @main.command()
 def logout():
+    from .utils.credentials import get_credentials
     logger.debug("Logout")
-    delete_token_from_file()
+    get_credentials().delete()
 
 @main.command()
 def login():
+    from .utils.auth import auth
     logger.debug("Login")
     auth()
 
 @main.command()
-def organization():
+@click.argument('name', required=False, shell_complete=complete('complete_organizations'))
+def organization(name):
+    """Switch organization, by NAME or id, or pick one from a list."""
+    from .utils.auth import auth
     logger.debug("Change organization")
-    auth(switch_organization=True)
+    auth(switch_organization=True, organization=name)
 
 @main.command()
-def project():
+@click.argument('name', required=False, shell_complete=complete('complete_projects'))
+def project(name):
+    """Switch project, by NAME or id, or pick one from a list."""
+    from .utils.auth import auth
     logger.debug("Change project")
-    auth(switch_project=True)
+    auth(switch_project=True, project=name)
+
+@main.command()
+@click.argument('shell', type=click.Choice(['bash', 'zsh', 'fish']))
+def completion(shell):
+    """Print the completion script, e.g. eval "$(ph completion bash)" in ~/.bashrc."""
+    from click.shell_completion import get_completion_class
+    click.echo(get_completion_class(shell)(main, {}, 'ph', '_PH_COMPLETE').source())
+
+@main.command('completion-refresh', hidden=True)
+def completion_refresh():
+    """Refresh the completion caches, started in the background by completion itself."""
+    from .utils.completion import refresh
+    if not refresh():
+        sys.exit(1)
 
 @click.group()
 def flags():
     pass
 
+def project_options(command):
+    """Options for commands that can query several projects at once."""
+    decorators = [
+        click.option('--projects', default=None, help='Comma separated project ids or names to query concurrently'),
+        click.option('--all-projects', is_flag=True, help='Query every project of the organization'),
+        click.option('--parallel', type=int, default=None, help='Max projects queried at once'),
+    ]
+    for decorator in reversed(decorators):
+        command = decorator(command)
+    return command
+
+def select_projects(projects, all_projects, offline):
+    """Projects picked with --projects/--all-projects, or None for the current project only."""
+    if not projects and not all_projects:
+        return None
+    if offline:
+        raise click.UsageError("--offline reads the current project only.")
+    from .utils.auth import get_headers
+    from .utils.projects import select_projects as resolve_projects
+    names = [name.strip() for name in projects.split(',') if name.strip()] if projects else []
+    selected = resolve_projects(get_headers(), names, all_projects)
+    if selected is None:
+        sys.exit(1)
+    return selected
+
 @flags.command()
-def list():
+@click.option('--limit', type=int, default=None, help='Max number of flags to list')
+@click.option('--fields', default=None, help='Comma separated fields to print, e.g. key,name,active')
+@click.option('-f', '--format', 'output_format', type=click.Choice(FORMATS), default=None, help='Output format when not interactive, defaults to --output')
+@click.option('--no-interactive', is_flag=True, help='Print flags instead of prompting for one')
+@click.option('--offline', is_flag=True, help='Read from the local snapshot (see `ph flags sync`)')
+@project_options
+def list(limit, fields, output_format, no_interactive, offline, projects, all_projects, parallel):
     logger.debug("List flags")
-    list_flags()    
+    fields = fields.split(',') if fields else None
+    selected = select_projects(projects, all_projects, offline)
+    if selected is not None:
+        from .utils.auth import get_headers
+        from .utils.flags import DEFAULT_FIELDS, print_projects_flags
+        ok = print_projects_flags(selected, get_headers(), limit, fields or DEFAULT_FIELDS, output_format, parallel)
+        sys.exit(0 if ok else 1)
+    from .utils.flags import list_flags
+    interactive = not no_interactive and not offline and sys.stdin.isatty() and sys.stdout.isatty()
+    list_flags(limit, fields, interactive, output_format, offline)
+
+@flags.command()
+@click.argument('query', required=False)
+@click.option('--limit', type=int, default=20, help='Max number of results')
+@click.option('--fields', default=None, help='Comma separated fields to print, e.g. key,name,active')
+@click.option('-f', '--format', 'output_format', type=click.Choice(FORMATS), default=None, help='Output format, defaults to --output')
+@click.option('-i', '--interactive', is_flag=True, help='Filter as you type, then pick a flag')
+def search(query, limit, fields, output_format, interactive):
+    """Search flags by key, name and tags. Without QUERY, filter interactively."""
+    logger.debug("Search flags")
+    if interactive or not query:
+        if not (sys.stdin.isatty() and sys.stdout.isatty()):
+            raise click.UsageError("Pass a QUERY when not running in a terminal.")
+        from .utils.search import interactive_search
+        ok = interactive_search(query or '')
+    else:
+        from .utils.search import search_flags
+        ok = search_flags(query, limit, fields.split(',') if fields else None, output_format)
+    if not ok:
+        sys.exit(1)
 
 @flags.command()
 @click.argument('key')
 @click.option('-d', '--description', default="", help='Desc/Name of the flag')
 @click.option('-p', '--rollout-percentage', default=100, help='Rollout percentage of the flag')
-def create(key, description, rollout_percentage):
+@click.option('--defer', is_flag=True, help='Record in the local journal and return, send later with `ph sync flush`')
+def create(key, description, rollout_percentage, defer):
+    from .utils.flags import create_flag
     logger.debug("Create flag")
-    create_flag(key, description, rollout_percentage)
+    if defer:
+        return defer_mutation('create', [key], description=description, rollout_percentage=rollout_percentage)
+    sys.exit(0 if create_flag(key, description, rollout_percentage) else 1)
 
 @flags.command()
-@click.argument('key')
-def show(key):
+@click.argument('key', shell_complete=complete('complete_flag_keys'))
+@click.option('--offline', is_flag=True, help='Read from the local snapshot (see `ph flags sync`)')
+@click.option('--fields', default=None, help='Comma separated fields to print per project, e.g. active,rollout_percentage')
+@click.option('-f', '--format', 'output_format', type=click.Choice(FORMATS), default=None, help='Output format, defaults to --output')
+@project_options
+def show(key, offline, fields, output_format, projects, all_projects, parallel):
     logger.debug("Show flag")
-    show_flag(key)
+    selected = select_projects(projects, all_projects, offline)
+    if selected is not None:
+        from .utils.auth import get_headers
+        from .utils.flags import DEFAULT_FIELDS, show_projects_flag
+        fields = fields.split(',') if fields else DEFAULT_FIELDS
+        ok = show_projects_flag(selected, key, get_headers(), fields, output_format, parallel)
+        sys.exit(0 if ok else 1)
+    from .utils.flags import show_flag
+    sys.exit(0 if show_flag(key, offline) else 1)
 
+@flags.command()
+@click.option('--full', is_flag=True, help='Download every flag instead of only the changed ones')
+def sync(full):
+    """Sync all flags to the local snapshot used by --offline."""
+    from .utils.snapshot import sync_flags
+    logger.debug("Sync flags")
+    if not sync_flags(full=full):
+        sys.exit(1)
 
 @flags.command()
-@click.argument('key')
-def delete(key):
+@click.option('--interval', type=float, default=5, help='Seconds between polls after a change')
+@click.option('--max-interval', type=float, default=60, help='Polls slow down to this while nothing changes')
+@click.option('-f', '--format', 'output_format', type=click.Choice(['text', 'ndjson']), default='text', help='Output format')
+def watch(interval, max_interval, output_format):
+    """Print flag changes (added, removed, toggled, rollout changed) as they happen."""
+    from .utils.watch import watch_flags
+    logger.debug("Watch flags")
+    if not watch_flags(interval, max(interval, max_interval), output_format):
+        sys.exit(1)
+
+@flags.command()
+@click.option('-o', '--output', 'path', default='flags.ndjson', type=click.Path(dir_okay=False), help='NDJSON file, gzipped when it ends in .gz')
+@click.option('--full', is_flag=True, help='Download every flag instead of only the changed ones')
+def export(path, full):
+    """Export all flags to a file. Exporting to the same file again only fetches changes."""
+    from .utils.snapshot import sync_flags
+    logger.debug("Export flags")
+    if not sync_flags(path, full):
+        sys.exit(1)
+
+
+def select_options(command):
+    """Options for commands that act on one key or many flags at once."""
+    decorators = [
+        click.argument('keys', nargs=-1, shell_complete=complete('complete_flag_keys')),
+        click.option('-m', '--match', multiple=True, help='Glob pattern of flag keys, e.g. checkout-*'),
+        click.option('-t', '--tag', multiple=True, help='Select flags with this tag'),
+        click.option('--parallel', type=int, default=None, help='Max concurrent API calls'),
+        click.option('--dry-run', is_flag=True, help='Only show the selected flags'),
+        click.option('--defer', is_flag=True, help='Record in the local journal and return, send later with `ph sync flush`'),
+    ]
+    for decorator in reversed(decorators):
+        command = decorator(command)
+    return command
+
+def defer_mutation(op, keys, match=(), tag=(), **fields):
+    """Journal the mutation instead of sending it. Only explicit keys can be deferred."""
+    if match or tag or not keys:
+        raise click.UsageError("--defer needs flag keys, not --match or --tag.")
+    from .utils.journal import defer
+    return defer(op, keys, **fields)
+
+def is_bulk(keys, match, tag):
+    if not keys and not match and not tag:
+        raise click.UsageError("Pass a key, --match or --tag.")
+    return len(keys) > 1 or bool(match) or bool(tag)
+
+@flags.command()
+@select_options
+def delete(keys, match, tag, parallel, dry_run, defer):
+    from .utils.flags import delete_flag
     logger.debug("Delete flag")
-    delete_flag(key)
+    if defer:
+        return defer_mutation('delete', keys, match, tag)
+    if is_bulk(keys, match, tag):
+        from .utils.bulk import bulk_action
+        ok = bulk_action('delete', keys, match, tag, parallel, dry_run)
+        sys.exit(0 if ok else 1)
+    sys.exit(0 if delete_flag(keys[0]) else 1)
 
 @flags.command()
-@click.argument('key')
-def disable(key):
+@select_options
+def disable(keys, match, tag, parallel, dry_run, defer):
+    from .utils.flags import disable_flag
     logger.debug("Disable flag")
-    disable_flag(key, False)
+    if defer:
+        return defer_mutation('disable', keys, match, tag)
+    if is_bulk(keys, match, tag):
+        from .utils.bulk import bulk_action
+        ok = bulk_action('disable', keys, match, tag, parallel, dry_run)
+        sys.exit(0 if ok else 1)
+    sys.exit(0 if disable_flag(keys[0], False) else 1)
 
 @flags.command()
-@click.argument('key')
-def enable(key):
+@select_options
+def enable(keys, match, tag, parallel, dry_run, defer):
+    from .utils.flags import disable_flag
     logger.debug("Enable flag")
-    disable_flag(key, True)
+    if defer:
+        return defer_mutation('enable', keys, match, tag)
+    if is_bulk(keys, match, tag):
+        from .utils.bulk import bulk_action
+        ok = bulk_action('enable', keys, match, tag, parallel, dry_run)
+        sys.exit(0 if ok else 1)
+    sys.exit(0 if disable_flag(keys[0], True) else 1)
 
 @flags.command()
-@click.argument('key')
+@select_options
 @click.option('-d', '--description', default=None, help='Desc/Name of the flag')
-@click.option('-p', '--rollout-percentage', default=None, help='Rollout percentage of the flag')
-def update(key, description, rollout_percentage):
+@click.option('-p', '--rollout-percentage', type=click.IntRange(0, 100), default=None, help='Rollout percentage of the flag')
+@click.option('-g', '--group', type=click.IntRange(0), default=0, help='Condition group the rollout percentage applies to, 0 is the first')
+def update(keys, match, tag, parallel, dry_run, defer, description, rollout_percentage, group):
+    from .utils.flags import update_flag
     logger.debug("Update flag")
 
-    if not description and not rollout_percentage:
-        logger.info(f"No changes to be made for flag: {key}")
+    if not description and rollout_percentage is None:
+        logger.info(f"No changes to be made for flag: {', '.join(keys)}")
         return
-    update_flag(key, description, rollout_percentage)
+    if defer:
+        return defer_mutation('update', keys, match, tag, description=description,
+                              rollout_percentage=rollout_percentage, group=group)
+    if is_bulk(keys, match, tag):
+        from .utils.bulk import bulk_action
+        ok = bulk_action('update', keys, match, tag, parallel, dry_run,
+                         description=description, rollout_percentage=rollout_percentage, group=group)
+        sys.exit(0 if ok else 1)
+    sys.exit(0 if update_flag(keys[0], description, rollout_percentage, group=group) else 1)
+
+@flags.command()
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Only show the plan')
+@click.option('--prune', is_flag=True, help='Delete flags that are not in the file')
+@click.option('--parallel', type=int, default=None, help='Max concurrent API calls')
+def apply(file, dry_run, prune, parallel):
+    from .utils.apply import apply_flags
+    logger.debug("Apply flags")
+    if not apply_flags(file, dry_run, prune, parallel):
+        sys.exit(1)
+
+def project_pair_options(command):
+    """--from/--to project options shared by flags diff and flags promote."""
+    decorators = [
+        click.option('--from', 'source', required=True, help='Project id or name to read flags from'),
+        click.option('--to', 'target', required=True, help='Project id or name to compare with'),
+    ]
+    for decorator in reversed(decorators):
+        command = decorator(command)
+    return command
+
+@flags.command()
+@project_pair_options
+@click.option('-f', '--format', 'output_format', type=click.Choice(FORMATS), default=None, help='Output format, defaults to --output')
+def diff(source, target, output_format):
+    """Show flags that differ between two projects. Exits with 1 when there are differences."""
+    from .utils.promote import diff_flags
+    logger.debug("Diff flags")
+    same = diff_flags(source, target, output_format)
+    if not same:
+        sys.exit(2 if same is None else 1)
+
+@flags.command()
+@project_pair_options
+@click.argument('keys', nargs=-1)
+@click.option('-m', '--match', multiple=True, help='Glob pattern of flag keys, e.g. checkout-*')
+@click.option('--all', 'all_flags', is_flag=True, help='Promote every flag that differs')
+@click.option('--parallel', type=int, default=None, help='Max concurrent API calls')
+@click.option('--dry-run', is_flag=True, help='Only show the plan')
+def promote(source, target, keys, match, all_flags, parallel, dry_run):
+    """Copy flags from one project to another, creating or updating only what differs."""
+    from .utils.promote import promote_flags
+    logger.debug("Promote flags")
+    if not keys and not match and not all_flags:
+        raise click.UsageError("Pass flag keys, --match or --all.")
+    if not promote_flags(source, target, keys, match, all_flags, dry_run, parallel):
+        sys.exit(1)
+
+@flags.command()
+@click.argument('key', shell_complete=complete('complete_flag_keys'))
+@click.option('-i', '--distinct-id', 'distinct_ids', multiple=True, help='Distinct id to evaluate the flag for')
+@click.option('--distinct-ids-file', type=click.Path(allow_dash=True, dir_okay=False), default=None, help='File with one distinct id per line, - for stdin')
+@click.option('--property', 'properties', multiple=True, help='Person property key=value used by property filters')
+@click.option('--definitions', type=click.Path(exists=True, dir_okay=False), default=None, help='Local JSON/NDJSON file with flag definitions')
+@click.option('--workers', type=int, default=None, help='Worker processes, defaults to the number of CPUs')
+@click.option('-f', '--format', 'output_format', type=click.Choice(FORMATS), default=None, help='Output format of the results, defaults to --output')
+@click.option('--summary-only', is_flag=True, help='Only print the exposure statistics')
+def evaluate(key, distinct_ids, distinct_ids_file, properties, definitions, workers, output_format, summary_only):
+    from itertools import chain
+    from .utils.evaluate import evaluate_flag, read_distinct_ids
+    logger.debug("Evaluate flag")
+
+    if not distinct_ids and not distinct_ids_file:
+        raise click.UsageError("Pass --distinct-id or --distinct-ids-file.")
+    ids = chain(distinct_ids, read_distinct_ids(distinct_ids_file) if distinct_ids_file else [])
+    person_properties = dict(prop.split('=', 1) for prop in properties if '=' in prop)
+    if not evaluate_flag(key, ids, person_properties, definitions, workers, output_format, summary_only):
+        sys.exit(1)
+
+@main.command()
+@click.argument('file', type=click.File('r'), default='-')
+@click.option('--parallel', type=int, default=None, help='Max commands running at once')
+@click.option('--fail-fast', is_flag=True, help='Skip the remaining commands after a failure')
+def batch(file, parallel, fail_fast):
+    """Run ph commands from FILE (or stdin), one per line, in this process.
+
+    Commands on different flags run concurrently. One JSON result per command is printed."""
+    from .utils.batch import run_batch
+    logger.debug("Batch")
+    if not run_batch(file, parallel, fail_fast):
+        sys.exit(1)
+
+@main.command()
+@click.option('--file', 'path', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='NDJSON or CSV file of events, may be gzipped (.ndjson.gz, .csv.gz)')
+@click.option('--api-key', envvar='PH_PROJECT_API_KEY', default=None, help='Project API key, read from the current project when not given')
+@click.option('--batch-size', type=click.IntRange(1), default=500, help='Max events per request')
+@click.option('--parallel', type=int, default=None, help='Max concurrent uploads')
+@click.option('--historical', is_flag=True, help='Send as a historical migration (backfill of past events)')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run and start over')
+@click.option('--dry-run', is_flag=True, help='Read, validate and compress without sending')
+def capture(path, api_key, batch_size, parallel, historical, restart, dry_run):
+    """Send the events of a large NDJSON or CSV file in gzipped batches.
+
+    An interrupted run resumes from its checkpoint when started again."""
+    from .utils.capture import capture_events
+    logger.debug("Capture")
+    if not capture_events(path, api_key, batch_size, parallel, historical, restart, dry_run):
+        sys.exit(1)
+
+@main.command()
+@click.argument('query')
+@click.option('-o', '--output', 'path', type=click.Path(dir_okay=False), default=None,
+              help='Write to a file, in the format of its extension: .csv, .ndjson, .json, .parquet, .arrow')
+@click.option('-f', '--format', 'output_format', type=click.Choice(FORMATS + ['parquet', 'arrow']), default=None,
+              help='Output format, defaults to the file extension or --output')
+@click.option('--page-size', type=click.IntRange(1, 50000), default=10000, help='Rows per request when paging an ordered query')
+@click.option('--limit', type=click.IntRange(1), default=None, help='Max number of rows')
+@click.option('--from', 'date_from', default=None, help='Start of the {filters} time range, e.g. -7d or 2024-01-01')
+@click.option('--to', 'date_to', default=None, help='End of the {filters} time range')
+@click.option('--parallel', type=click.IntRange(1), default=2, help='Pages of an ordered query requested ahead of the one being written')
+@click.option('--no-cache', is_flag=True, help='Run the query even when a cached result is fresh')
+def query(query, path, output_format, page_size, limit, date_from, date_to, parallel, no_cache):
+    """Run a HogQL QUERY (- reads it from stdin) on the current project and stream the rows.
+
+    Only a query with an ORDER BY on columns that make rows unique is paged; any other query returns
+    at most 50,000 rows."""
+    from .utils.query import run_query
+    logger.debug("Query")
+    if query == '-':
+        query = sys.stdin.read()
+    if not run_query(query, output_format, path, page_size, limit, date_from, date_to, parallel, not no_cache):
+        sys.exit(1)
+
+
+def export_options(command):
+    """Options shared by the resumable exports."""
+    decorators = [
+        click.option('-o', '--output', 'path', default=None, type=click.Path(dir_okay=False), help='NDJSON file, defaults to persons.ndjson or cohort_{id}.ndjson'),
+        click.option('--page-size', type=click.IntRange(1), default=100, help='Persons per request'),
+        click.option('--parallel', type=click.IntRange(1), default=4, help='Pages requested ahead when the API pages by offset'),
+        click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted export and start over'),
+    ]
+    for decorator in reversed(decorators):
+        command = decorator(command)
+    return command
+
+@click.group()
+def persons():
+    pass
+
+@persons.command('export')
+@export_options
+def persons_export(path, page_size, parallel, restart):
+    """Export every person of the current project, resuming an interrupted export of the same file."""
+    from .utils.export import export_persons
+    logger.debug("Export persons")
+    if not export_persons(path or 'persons.ndjson', page_size, parallel, restart):
+        sys.exit(1)
+
+@click.group()
+def cohorts():
+    pass
+
+@cohorts.command('export')
+@click.argument('cohort_id', type=int)
+@export_options
+def cohorts_export(cohort_id, path, page_size, parallel, restart):
+    """Export the persons of a cohort, resuming an interrupted export of the same file."""
+    from .utils.export import export_cohort
+    logger.debug("Export cohort")
+    if not export_cohort(cohort_id, path or f'cohort_{cohort_id}.ndjson', page_size, parallel, restart):
+        sys.exit(1)
+
+@click.group(name="sync")
+def sync_group():
+    """Send the flag changes recorded with --defer."""
+
+@sync_group.command()
+@click.option('--parallel', type=int, default=None, help='Max flags updated at once')
+@click.option('--dry-run', is_flag=True, help='Only show the writes left after collapsing the journal')
+def flush(parallel, dry_run):
+    """Collapse the journal per flag and send what is left. Failed changes stay in the journal."""
+    from .utils.journal import flush as flush_journal
+    logger.debug("Flush journal")
+    if not flush_journal(parallel, dry_run):
+        sys.exit(1)
+
+@sync_group.command()
+def clear():
+    """Drop every deferred change without sending it."""
+    from .utils.journal import clear as clear_journal
+    logger.info(f"Dropped {clear_journal()} journal entries.")
+
+
+class LazyRichHandler(logging.Handler):
+    """Imports rich and creates the RichHandler on the first log record."""
+
+    def __init__(self):
+        super().__init__()
+        self.handler = None
 
+    def emit(self, record):
+        if self.handler is None:
+            from rich.logging import RichHandler
+            from .utils.output import get_log_console
+            self.handler = RichHandler(
+                console=get_log_console(), show_time=False, show_level=True, show_path=False)
+        self.handler.handle(record)
 
 def setup_logger():
     # Set the log level for the root logger to NOTSET (this is required to allow handlers to control the logging level)
@@ -100,9 +511,10 @@ def setup_logger():
 
     # Setup the 'ph' logger to use RichHandler with the shared console instance
     logger = logging.getLogger('ph')
+    if any(isinstance(handler, LazyRichHandler) for handler in logger.handlers):
+        return  # Already set up, e.g. by an earlier command of `ph batch`
     logger.setLevel(app_log_level)
-    rich_handler = RichHandler(
-        console=console, show_time=False, show_level=True, show_path=False)
+    rich_handler = LazyRichHandler()
     rich_handler.setLevel(app_log_level)
     # Replace any default handlers with just the RichHandler
     logger.handlers = [rich_handler]
@@ -114,6 +526,9 @@ def setup_logger():
 
 
 main.add_command(flags)
+main.add_command(sync_group)
+main.add_command(persons)
+main.add_command(cohorts)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+from ph.utils.auth import get_headers
+from ph.utils.credentials import get_credentials
+from ph.utils.flags import build_flag, create_flag, delete_flag, iter_flags, update_flag_fields
+from ph.utils import flag_index
+from ph.utils.client import APIError
+from ph.utils.output import get_console
+from ph.utils.workers import run_parallel
+
+logger = logging.getLogger('ph')
+
+# Flag fields a desired-state file can manage
+MANAGED_FIELDS = ['name', 'active', 'filters', 'tags', 'ensure_experience_continuity']
+
+def load_desired_state(path):
+    """Load flags from a YAML or JSON file, either a list or {"flags": [...]}."""
+    with open(path, 'r') as file:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required for YAML files: pip install 'ph[yaml]'")
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+
+    flags = data.get('flags', []) if isinstance(data, dict) else data
+    desired = {}
+    for item in flags or []:
+        if not isinstance(item, dict) or not item.get('key'):
+            raise ValueError(f"Every flag needs a key: {item!r}")
+        if item['key'] in desired:
+            raise ValueError(f"Duplicate flag key: {item['key']}")
+        desired[item['key']] = item
+    return desired
+
+def desired_fields(item):
+    """Fields of a desired flag, with `rollout_percentage` as a shorthand for a single condition group."""
+    fields = {field: item[field] for field in MANAGED_FIELDS if field in item}
+    if 'filters' not in fields and 'rollout_percentage' in item:
+        fields['filters'] = build_flag(item['key'], "", item['rollout_percentage'])['filters']
+    return fields
+
+def normalize(value):
+    """Drop empty values so server defaults (None, {}, []) do not show up as changes."""
+    if isinstance(value, dict):
+        value = {k: normalize(v) for k, v in value.items()}
+        return {k: v for k, v in value.items() if v not in (None, {}, [])}
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    return value
+
+def changed_fields(current, fields):
+    return {field: value for field, value in fields.items()
+            if normalize(current.get(field)) != normalize(value)}
+
+def plan_changes(desired, current, prune=False):
+    """Compute the minimal list of create/update/delete operations."""
+    plan = []
+    for key, item in desired.items():
+        flag = current.get(key)
+        if item.get('deleted'):
+            if flag:
+                plan.append({"action": "delete", "key": key, "id": flag['id']})
+            continue
+        fields = desired_fields(item)
+        if not flag:
+            plan.append({"action": "create", "key": key, "changes": fields})
+            continue
+        changes = changed_fields(flag, fields)
+        if changes:
+            plan.append({"action": "update", "key": key, "id": flag['id'], "changes": changes,
+                         "version": flag.get('version')})
+
+    if prune:
+        for key, flag in current.items():
+            if key not in desired:
+                plan.append({"action": "delete", "key": key, "id": flag['id']})
+    return plan
+
+def print_plan(plan):
+    console = get_console()
+    if not plan:
+        console.print("No changes. Flags are up to date.")
+        return
+    for item in plan:
+        if item['action'] == 'create':
+            console.print(f"[green]+ {item['key']}[/green]")
+        elif item['action'] == 'update':
+            console.print(f"[yellow]~ {item['key']}[/yellow] ({', '.join(item['changes'])})")
+        else:
+            console.print(f"[red]- {item['key']}[/red]")
+    counts = {action: sum(1 for item in plan if item['action'] == action) for action in ('create', 'update', 'delete')}
+    console.print(f"Plan: {counts['create']} to create, {counts['update']} to update, {counts['delete']} to delete.")
+
+def execute_item(project_id, headers, item):
+    key = item['key']
+    if item['action'] == 'create':
+        changes = dict(item['changes'])
+        return create_flag(key, changes.pop('name', ""), 100, project_id=project_id, headers=headers, **changes)
+    if item['action'] == 'delete':
+        return delete_flag(key, project_id=project_id, headers=headers, flag_id=item['id'])
+
+    changes = item['changes']
+    if item.get('version') is not None:
+        # Fail with a 409 instead of overwriting an edit made after the plan was computed
+        changes = dict(changes, version=item['version'])
+    return update_flag_fields(key, changes, project_id, headers, flag_id=item['id'])
+
+def execute_plan(plan, project_id, headers, parallel=None):
+    """Run the plan on a bounded worker pool. Returns the keys that failed."""
+    failed = []
+    for item, ok, error in run_parallel(plan, lambda item: execute_item(project_id, headers, item), parallel):
+        if not ok:
+            failed.append(item['key'])
+            if error:
+                logger.error(f"{item['action']} {item['key']} failed: {error}")
+    return failed
+
+def apply_flags(path, dry_run=False, prune=False, parallel=None):
+    """Reconcile the project's flags with a desired-state file."""
+    try:
+        desired = load_desired_state(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not load {path}: {e}")
+        return False
+
+    headers = get_headers()
+    project_id = get_credentials().project
+
+    current = {}
+    try:
+        for flag in iter_flags(project_id, headers):
+            current[flag['key']] = flag
+    except APIError:
+        logger.error("Could not fetch the current flags, nothing was applied.")
+        return False
+    flag_index.remember_flags(project_id, current.values())
+
+    plan = plan_changes(desired, current, prune)
+    print_plan(plan)
+    if dry_run or not plan:
+        return True
+
+    failed = execute_plan(plan, project_id, headers, parallel)
+    get_console().print(f"Applied {len(plan) - len(failed)}/{len(plan)} changes.")
+    if failed:
+        logger.error(f"Failed: {', '.join(sorted(failed))}")
+    return not failed
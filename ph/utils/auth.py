@@ -1,89 +1,12 @@
 import logging
 from time import sleep
-import requests
+from ph.utils import client
+from ph.utils.client import log_error
 import os
-import json
-import inquirer
-import webbrowser 
+from ph.utils.credentials import PH_ENDPOINT, get_credentials
 
 logger = logging.getLogger('ph')
 
-CREDENTIALS_FILE = os.path.expanduser('~/.posthog/credentials.json')
-PH_ENDPOINT = os.environ.get('PH_ENDPOINT', 'app.dev.posthog.dev')
-
-def save_token_to_file(token, org, project):
-    os.makedirs(os.path.dirname(CREDENTIALS_FILE), exist_ok=True)
-    data = {}
-    try:
-        with open(CREDENTIALS_FILE, 'r') as file:
-            try:
-                data = json.load(file)
-            except Exception as e:
-                pass
-    except FileNotFoundError:
-        pass
-
-    credentials = data.get("credentials", {})
-    endpoint = {"token": token, "organization": org, "project": project}
-    credentials[PH_ENDPOINT] = endpoint
-    data["credentials"] = credentials
-
-    with open(CREDENTIALS_FILE, 'w') as file:
-        try:
-            json.dump(data, file)
-        except Exception as e:
-            return None
-
-def read_token_from_file():
-    try:
-        with open(CREDENTIALS_FILE, 'r') as file:
-            try:
-                data = json.load(file)
-            except Exception:
-                return None
-            return data["credentials"][PH_ENDPOINT]["token"]
-    except (FileNotFoundError, KeyError):
-        return None
-    
-def read_organization_from_file():
-    try:
-        with open(CREDENTIALS_FILE, 'r') as file:
-            try:
-                data = json.load(file)
-            except Exception:
-                return None
-            return data["credentials"][PH_ENDPOINT]["organization"]
-    except (FileNotFoundError, KeyError):
-        return None
-    
-def read_project_from_file():
-    try:
-        with open(CREDENTIALS_FILE, 'r') as file:
-            try:
-                data = json.load(file)
-            except Exception:
-                return None
-            return data["credentials"][PH_ENDPOINT]["project"]
-    except (FileNotFoundError, KeyError):
-        return None
-
-def delete_token_from_file():
-    try:
-        if os.path.exists(CREDENTIALS_FILE):
-            data = {}
-            with open(CREDENTIALS_FILE, 'r') as file:
-                try:
-                    data = json.load(file)
-                except Exception:
-                    return
-                if PH_ENDPOINT in data["credentials"]:
-                    del data["credentials"][PH_ENDPOINT]
-            with open(CREDENTIALS_FILE, 'w') as file:
-                json.dump(data, file)
-
-    except (FileNotFoundError, KeyError) as e:
-        return
-
 def get_url(api_part):
     api_protocol = os.environ.get('PH_API_PROTOCOL_WEB', 'https')
     api_port = os.environ.get('PH_API_PORT_WEB', '')
@@ -94,13 +17,13 @@ def get_url(api_part):
 def get_token():
     api_token = os.environ.get('PH_API_TOKEN')
     if not api_token:
-        api_token = read_token_from_file()
+        api_token = get_credentials().token
 
     if not api_token:
         api_token = create_token()
         if api_token:
             os.environ['PH_API_TOKEN'] = api_token
-            save_token_to_file(api_token, "", "")
+            get_credentials().save(api_token, "", "")
         else:
             logger.error("No token provided.")
             exit()
@@ -121,38 +44,32 @@ def prompt_for_token(auth_url):
     return input("Token: ")
 
 
-def auth(switch_organization=False, switch_project=False):
-    """Authenticate the user or switch organization or project."""
+def auth(switch_organization=False, switch_project=False, organization=None, project=None):
+    """Authenticate the user or switch organization or project (by name or id when given)."""
     headers = get_headers()
 
     # validate if account is active
     url = get_url('api/organizations')
     logger.debug(f"Validating account... {url} {headers}")
-    response = requests.get(url, headers=headers, allow_redirects=False)
+    response = client.get(url, headers=headers)
     if response.status_code == 200:
         data = response.json()
-        org = read_organization_from_file()
+        org = get_credentials().organization
 
         if not org or switch_organization:
-            select_org(data)
-        project = read_project_from_file()
-        
-        if not project or switch_project:
-            list_project()
+            select_org(data, organization)
+
+        if not get_credentials().project or switch_project:
+            list_project(project)
     else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
-        delete_token_from_file()
+        log_error(response)
+        get_credentials().delete()
         exit(-1)
 
 def create_token():
     url = get_url('api/login/cli/start')
 
-    response = requests.post(url, allow_redirects=False)
+    response = client.post(url)
 
     if response.status_code == 200:
         data = response.json()
@@ -164,11 +81,12 @@ def create_token():
         # url = get_url(f'login?next=/api/login/cli?code={code}')
         logger.info(f"Please authenticate by visiting the following URL: {url}")
 
+        import webbrowser
         webbrowser.open(url)
 
         while True:
             url = get_url('api/login/cli/check')
-            response = requests.get(url, allow_redirects=False, params={"code": code})
+            response = client.get(url, params={"code": code})
 
             if response.status_code == 200:
                 data = response.json()
@@ -184,69 +102,69 @@ def create_token():
                 else:
                     sleep(1)
             else:
-                logger.error(f"Error: {response.status_code}")
+                log_error(response)
                 return None
 
     else:
-        logger.error(f"Error: {response.status_code}")
+        log_error(response)
 
     return None
 
-def select_org(data):
-    """Select the organization."""
-    results = data.get('results')
+def choose(results, kind, choice=None):
+    """Pick an option by name or id when `choice` is given, otherwise prompt for it."""
+    if choice:
+        for option in results:
+            if choice in (option['name'], str(option['id'])):
+                return option['name'], option['id']
+        logger.error(f"{kind.capitalize()} not found: {choice}")
+        exit(-1)
+
+    import inquirer
     # TODO: name isnt unique
     display_to_id = {option['name']: option['id'] for option in results}
     choices = list(display_to_id.keys())
 
     questions = [
-        inquirer.List('select_org',
-                      message="Select organization",
+        inquirer.List('select',
+                      message=f"Select {kind}",
                       choices=choices,
                       ),
     ]
     answers = inquirer.prompt(questions)
-    selected_display = answers.get('select_org')
-    selected_id = display_to_id[selected_display]
+    selected_display = answers.get('select')
+    return selected_display, display_to_id[selected_display]
+
+def select_org(data, choice=None):
+    """Select the organization."""
+    from ph.utils.completion import remember_organizations
+    results = data.get('results')
+    remember_organizations(results)
+    selected_display, selected_id = choose(results, "organization", choice)
     logger.info(f"Selected organization: {selected_display}: {selected_id}")
-    save_token_to_file(get_token(), selected_id, "")
+    get_credentials().save(get_token(), selected_id, "")
 
-def select_project(data):
+def select_project(data, choice=None):
     """Select the project."""
+    from ph.utils.completion import remember_projects
     results = data.get('results')
-    display_to_id = {option['name']: option['id'] for option in results}
-    choices = list(display_to_id.keys())
-
-    questions = [
-        inquirer.List('select_project',
-                      message="Select project",
-                      choices=choices,
-                      ),
-    ]
-    answers = inquirer.prompt(questions)
-    selected_display = answers.get('select_project')
-    selected_id = display_to_id[selected_display]
+    org = get_credentials().organization
+    remember_projects(org, results)
+    selected_display, selected_id = choose(results, "project", choice)
     logger.info(f"Selected project: {selected_display}: {selected_id}")
-    org = read_organization_from_file()
-    save_token_to_file(get_token(), org, selected_id)
+    get_credentials().save(get_token(), org, selected_id)
 
-def list_project():
+def list_project(choice=None):
     """Select the project."""
     headers = get_headers()
 
-    org = read_organization_from_file()
+    org = get_credentials().organization
     url = get_url(f'api/organizations/{org}/projects')
 
-    response = requests.get(url, headers=headers, allow_redirects=False)
+    response = client.get(url, headers=headers)
     if response.status_code == 200:
         data = response.json()
-        select_project(data)
+        select_project(data, choice)
     else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
-        delete_token_from_file()
+        log_error(response)
+        get_credentials().delete()
         exit(-1)
@@ -0,0 +1,167 @@
+import io
+import json
+import logging
+import shlex
+import sys
+import threading
+import time
+from ph.utils.workers import run_parallel
+
+logger = logging.getLogger('ph')
+
+# Commands whose positional arguments are the flag keys they touch. Commands on different keys
+# can run at the same time; anything else (list, sync, apply, --match, --tag, ...) runs alone.
+KEYED_COMMANDS = {'create', 'show', 'update', 'enable', 'disable', 'delete', 'evaluate'}
+# Commands that would prompt or make no sense inside a batch
+REJECTED_COMMANDS = {'batch', 'login', 'organization', 'project', 'watch'}
+
+class ThreadOutput:
+    """Stand-in for sys.stdout/sys.stderr that sends what each batch command prints to its own
+    buffer. Output of other threads goes to `fallback`, so it never mixes with the results."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    @property
+    def _target(self):
+        return getattr(self.local, 'buffer', None) or self.fallback
+
+    def capture(self, buffer):
+        self.local.buffer = buffer
+
+    def write(self, text):
+        return self._target.write(text)
+
+    def flush(self):
+        self._target.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+class BatchCommand:
+    def __init__(self, line_number, text, args, error=None):
+        self.line_number = line_number
+        self.text = text
+        self.args = args
+        # Set when the line could not be parsed: the command fails without running
+        self.error = error
+        self.keys = self._keys()
+
+    def _keys(self):
+        """Flag keys this command touches, or None when it may touch anything."""
+        if self.error:
+            return set()
+        if len(self.args) < 2 or self.args[0] != 'flags' or self.args[1] not in KEYED_COMMANDS:
+            return None
+        keys = set()
+        args = iter(self.args[2:])
+        for arg in args:
+            if arg in ('-m', '--match', '-t', '--tag') or arg.startswith(('--match=', '--tag=')):
+                return None
+            if arg.startswith('-'):
+                # Every option of these commands takes a value, except the boolean flags
+                if '=' not in arg and arg not in ('--dry-run', '--summary-only', '--offline', '--all-projects', '--defer'):
+                    next(args, None)
+                continue
+            keys.add(arg)
+        return keys
+
+def parse_commands(lines):
+    """One ph command per line, with or without the leading `ph`. Blank lines and # comments are skipped."""
+    commands = []
+    for line_number, line in enumerate(lines, 1):
+        text = line.strip()
+        if not text or text.startswith('#'):
+            continue
+        try:
+            args = shlex.split(text)
+        except ValueError as e:
+            commands.append(BatchCommand(line_number, text, [], error=f"Could not parse the command: {e}"))
+            continue
+        if args and args[0] == 'ph':
+            args = args[1:]
+        commands.append(BatchCommand(line_number, text, args))
+    return commands
+
+def plan_waves(commands):
+    """Split commands into waves that can run concurrently, keeping the file order for commands
+    that touch the same flag. A command that may touch any flag gets a wave of its own."""
+    waves = []
+    wave, wave_keys = [], set()
+    for command in commands:
+        if command.keys is None or command.keys & wave_keys:
+            if wave:
+                waves.append(wave)
+            wave, wave_keys = [], set()
+        if command.keys is None:
+            waves.append([command])
+            continue
+        wave.append(command)
+        wave_keys |= command.keys
+    if wave:
+        waves.append(wave)
+    return waves
+
+def run_command(command, stdout, stderr):
+    """Run one command through the click group and return its result record."""
+    from ph.main import main
+    buffer = io.StringIO()
+    stdout.capture(buffer)
+    stderr.capture(buffer)
+    start = time.perf_counter()
+    result = {"line": command.line_number, "command": command.text}
+    try:
+        if command.error:
+            raise ValueError(command.error)
+        if command.args and command.args[0] in REJECTED_COMMANDS:
+            raise ValueError(f"`{command.args[0]}` can not run in a batch")
+        value = main.main(args=command.args, prog_name='ph', standalone_mode=False)
+        failed = value is False or (type(value) is int and value != 0)
+        result.update(ok=not failed, exit_code=1 if failed else 0)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        result.update(ok=code == 0, exit_code=code)
+    except Exception as e:
+        import click
+        result.update(ok=False, exit_code=e.exit_code if isinstance(e, click.ClickException) else 1,
+                      error=e.format_message() if isinstance(e, click.ClickException) else str(e) or repr(e))
+    finally:
+        stdout.capture(None)
+        stderr.capture(None)
+    result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    result["output"] = buffer.getvalue()
+    return result
+
+def run_batch(lines, parallel=None, fail_fast=False, results=None):
+    """Run ph commands in this process, sharing the HTTP session, credentials and flag index.
+
+    Writes one JSON result per command, in input order, as each wave completes."""
+    results = results or sys.stdout
+    commands = parse_commands(lines)
+    stdout, stderr = ThreadOutput(sys.stderr), ThreadOutput(sys.stderr)
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr
+    ok = True
+    try:
+        for wave in plan_waves(commands):
+            if fail_fast and not ok:
+                for command in wave:
+                    results.write(json.dumps({"line": command.line_number, "command": command.text,
+                                              "ok": False, "skipped": True}) + "\n")
+                continue
+            records = {}
+            for command, record, error in run_parallel(wave, lambda command: run_command(command, stdout, stderr), parallel):
+                records[command.line_number] = record or {
+                    "line": command.line_number, "command": command.text, "ok": False, "error": str(error)}
+            for command in wave:
+                record = records[command.line_number]
+                ok = ok and record["ok"]
+                results.write(json.dumps(record) + "\n")
+            results.flush()
+    finally:
+        sys.stdout, sys.stderr = real_stdout, real_stderr
+    return ok
@@ -0,0 +1,74 @@
+import fnmatch
+import logging
+from rich.progress import Progress
+from ph.utils.auth import get_headers
+from ph.utils.credentials import get_credentials
+from ph.utils.flags import delete_flag, iter_flags, update_changes, update_flag_fields
+from ph.utils import flag_index
+from ph.utils.client import APIError
+from ph.utils.output import get_console
+from ph.utils.workers import run_parallel
+
+logger = logging.getLogger('ph')
+
+def select_flags(project_id, headers, keys=(), patterns=(), tags=()):
+    """Resolve keys, glob patterns and tags against a single list fetch."""
+    wanted = set(keys)
+    selected = []
+    for flag in iter_flags(project_id, headers):
+        key = flag['key']
+        if (key in wanted
+                or any(fnmatch.fnmatchcase(key, pattern) for pattern in patterns)
+                or set(tags) & set(flag.get('tags') or [])):
+            selected.append(flag)
+        wanted.discard(key)
+    return selected, sorted(wanted)
+
+def bulk_action(action, keys=(), patterns=(), tags=(), parallel=None, dry_run=False,
+                description=None, rollout_percentage=None, group=0):
+    """Run enable/disable/delete/update on every selected flag concurrently."""
+    headers = get_headers()
+    project_id = get_credentials().project
+
+    try:
+        selected, missing = select_flags(project_id, headers, keys, patterns, tags)
+    except APIError:
+        return False
+    flag_index.remember_flags(project_id, selected)
+
+    for key in missing:
+        logger.error(f"Flag not found: {key}")
+    if not selected:
+        logger.info("No flags matched.")
+        return not missing
+
+    console = get_console()
+    if dry_run:
+        for flag in selected:
+            console.print(f"{action} {flag['key']}")
+        console.print(f"{len(selected)} flags would be changed.")
+        return True
+
+    def run(flag):
+        if action == 'delete':
+            return delete_flag(flag['key'], project_id, headers, flag['id'])
+        if action == 'update':
+            changes = update_changes(flag, description, rollout_percentage, group)
+            if not changes:
+                return True
+        else:
+            changes = {"active": action == 'enable'}
+        return update_flag_fields(flag['key'], changes, project_id, headers, flag['id'])
+
+    failed = {}
+    with Progress(console=console, transient=True) as progress:
+        task = progress.add_task(f"{action.capitalize()} flags", total=len(selected))
+        for flag, ok, error in run_parallel(selected, run, parallel):
+            if not ok:
+                failed[flag['key']] = str(error) if error else "request failed"
+            progress.advance(task)
+
+    console.print(f"{action.capitalize()}: {len(selected) - len(failed)} succeeded, {len(failed)} failed.")
+    for key, reason in sorted(failed.items()):
+        console.print(f"[red]✗ {key}[/red]: {reason}")
+    return not failed and not missing
@@ -0,0 +1,362 @@
+"""Bulk event ingestion: stream an NDJSON/CSV file to the /batch/ endpoint.
+
+The file is read one line at a time and cut into batches bounded by event count and size. Batches are
+gzipped and sent by a thread pool with a bounded number of batches in flight, so memory stays constant
+whatever the size of the file. Batches finish out of order: the checkpoint offset only moves past a
+batch once every batch before it was accepted, and when a run stops, the byte ranges of the batches
+further ahead that were accepted anyway are saved with it. A resumed run starts at the offset and
+skips the lines in those ranges, so no accepted batch is sent twice.
+"""
+import csv
+import gzip
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ph.utils import client
+from ph.utils.auth import get_headers, get_url
+from ph.utils.client import log_error
+from ph.utils.credentials import POSTHOG_DIR, get_credentials, write_json_atomic
+from ph.utils.output import dumps, get_console, loads
+from ph.utils.workers import PH_PARALLELISM
+
+logger = logging.getLogger('ph')
+
+CHECKPOINT_DIR = os.path.join(POSTHOG_DIR, 'capture')
+# Defaults to the /batch/ endpoint of PH_ENDPOINT
+PH_CAPTURE_URL = os.environ.get('PH_CAPTURE_URL')
+PH_CAPTURE_GZIP_LEVEL = int(os.environ.get('PH_CAPTURE_GZIP_LEVEL', '6'))
+# Uncompressed bytes per request, well under the ingestion payload limit
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+CHECKPOINT_INTERVAL = 1
+MAX_LOGGED_INVALID = 10
+# Events without a uuid get one derived from their position and content, so an event sent again by
+# a resumed run has the same uuid as the first time and duplicates can be found by uuid
+EVENT_NAMESPACE = uuid.UUID('5b6f8f3e-8c1d-4f7a-9a43-0d2b1c6e7a10')
+CSV_FIELDS = {'event', 'distinct_id', 'timestamp', 'uuid'}
+
+def checkpoint_path(path):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CHECKPOINT_DIR, f"{digest}.json")
+
+def _open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+def file_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+def event_uuid(start, line):
+    """uuid5 of the line and its offset, formatted without the overhead of uuid.uuid5()."""
+    digest = bytearray(hashlib.sha1(EVENT_NAMESPACE.bytes + b'%d:' % start + line).digest()[:16])
+    digest[6] = (digest[6] & 0x0f) | 0x50
+    digest[8] = (digest[8] & 0x3f) | 0x80
+    text = digest.hex()
+    return f"{text[:8]}-{text[8:12]}-{text[12:16]}-{text[16:20]}-{text[20:]}"
+
+def get_api_key(headers, project_id):
+    """The project API key (phc_...) that /batch/ expects, read from the project."""
+    response = client.get(get_url(f'api/projects/{project_id}'), headers=headers)
+    if response.status_code != 200:
+        log_error(response)
+        return None
+    return response.json().get('api_token')
+
+def csv_event(row):
+    """Map a CSV row to an event: known columns stay top level, a `properties` JSON column and any
+    other column become properties."""
+    event = {name: value for name, value in row.items() if name in CSV_FIELDS and value}
+    properties = loads(row['properties']) if row.get('properties') else {}
+    for name, value in row.items():
+        if name not in CSV_FIELDS and name != 'properties' and name is not None and value != '':
+            properties[name] = value
+    if properties:
+        event['properties'] = properties
+    return event
+
+def invalid_reason(event):
+    if not isinstance(event, dict):
+        return "not a JSON object"
+    if not event.get('event'):
+        return "missing event"
+    if not event.get('distinct_id') and not (event.get('properties') or {}).get('distinct_id'):
+        return "missing distinct_id"
+    return None
+
+class Capture:
+    """One run over one file: reading, batching, sending and checkpointing."""
+
+    def __init__(self, path, api_key, url, batch_size, parallel=None, historical=False, dry_run=False):
+        self.path = path
+        self.format = file_format(path)
+        self.url = url
+        self.batch_size = batch_size
+        self.parallel = max(1, parallel or PH_PARALLELISM)
+        self.dry_run = dry_run
+        self.prefix = (b'{"api_key":' + dumps(api_key).encode('utf-8')
+                       + (b',"historical_migration":true' if historical else b'') + b',"batch":[')
+        stat = os.stat(path)
+        self.identity = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+        self.offset = 0
+        # [start, end) byte ranges past the offset whose batch was accepted, skipped when resuming
+        self.sent = []
+        self.events = 0
+        self.batches = 0
+        self.invalid = 0
+        self.rejected = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.checkpointed_at = 0
+
+    # Checkpoints
+
+    def load_checkpoint(self):
+        try:
+            with open(checkpoint_path(self.path), 'r') as file:
+                data = loads(file.read())
+        except (FileNotFoundError, ValueError):
+            return False
+        if any(data.get(name) != value for name, value in self.identity.items()):
+            logger.warning(f"{self.path} changed since the interrupted run, starting over.")
+            return False
+        self.offset = data.get('offset', 0)
+        self.sent = data.get('sent', [])
+        self.events = data.get('events', 0)
+        self.batches = data.get('batches', 0)
+        return self.offset > 0
+
+    def save_checkpoint(self, force=False):
+        if self.dry_run or not (force or time.monotonic() - self.checkpointed_at >= CHECKPOINT_INTERVAL):
+            return
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        self.sent = [[start, end] for start, end in self.sent if end > self.offset]
+        write_json_atomic(checkpoint_path(self.path), dict(self.identity, offset=self.offset, sent=self.sent,
+                                                           events=self.events, batches=self.batches))
+        self.checkpointed_at = time.monotonic()
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(checkpoint_path(self.path))
+        except FileNotFoundError:
+            pass
+
+    # Reading
+
+    def was_sent(self, start):
+        return any(sent_start <= start < sent_end for sent_start, sent_end in self.sent)
+
+    def read_events(self, file):
+        """Yield (serialized event or None for a line to skip, offset after it) from self.offset on."""
+        if self.format == 'csv':
+            yield from self._read_csv(file)
+            return
+        if self.offset:
+            file.seek(self.offset)
+        position = self.offset
+        for line in file:
+            start = position
+            position += len(line)
+            if not line.strip():
+                continue
+            if self.sent and self.was_sent(start):
+                yield None, position
+                continue
+            try:
+                event = loads(line)
+            except ValueError as e:
+                event = e
+            yield self._serialize(event, line, start, raw=True), position
+
+    def _read_csv(self, file):
+        header = file.readline()
+        fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+        if self.offset:
+            file.seek(self.offset)
+        lines = []
+        position = self.offset or len(header)
+
+        def text():
+            # A quoted value can span lines, so remember every line of the current record
+            nonlocal position
+            for line in file:
+                lines.append((position, line))
+                position += len(line)
+                yield line.decode('utf-8')
+        for row in csv.DictReader(text(), fieldnames=fieldnames):
+            start, line = lines[0]
+            lines.clear()
+            if self.sent and self.was_sent(start):
+                yield None, position
+                continue
+            try:
+                event = csv_event(row)
+            except ValueError as e:
+                event = e
+            yield self._serialize(event, line, start), position
+
+    def _serialize(self, event, line, start, raw=False):
+        """JSON bytes of a valid event with a uuid. `raw` reuses the line when it needs no change."""
+        reason = f"invalid JSON ({event})" if isinstance(event, ValueError) else invalid_reason(event)
+        if reason:
+            self.invalid += 1
+            if self.invalid <= MAX_LOGGED_INVALID:
+                logger.warning(f"Skipping the line at byte {start}: {reason}")
+            return None
+        if raw and event.get('uuid'):
+            return line.strip()
+        if not event.get('uuid'):
+            event['uuid'] = event_uuid(start, line)
+        return dumps(event).encode('utf-8')
+
+    def make_batches(self, file):
+        """Yield (events, end offset) batches of at most batch_size events and MAX_BATCH_BYTES."""
+        batch, size, end = [], 0, self.offset
+        for data, offset in self.read_events(file):
+            if data is not None:
+                if batch and (len(batch) >= self.batch_size or size + len(data) > MAX_BATCH_BYTES):
+                    yield batch, end
+                    batch, size = [], 0
+                batch.append(data)
+                size += len(data) + 1
+            end = offset
+        if batch or end != self.offset:
+            yield batch, end
+
+    # Sending
+
+    def send(self, batch):
+        """Gzip and post one batch (in a worker thread). Returns (ok, raw bytes, sent bytes)."""
+        if not batch:
+            return True, 0, 0
+        payload = self.prefix + b','.join(batch) + b']}'
+        body = gzip.compress(payload, compresslevel=PH_CAPTURE_GZIP_LEVEL)
+        if self.dry_run:
+            return True, len(payload), len(body)
+        # /batch/ does not deduplicate on uuid: a batch is only retried when it surely did not reach the
+        # server (429, connect timeout), anything else stops the run at the last accepted batch
+        response = client.post(self.url, data=body,
+                               headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        if response.status_code == 400:
+            logger.error(f"Batch of {len(batch)} events rejected: {response.text[:200]}")
+            return False, len(payload), len(body)
+        if response.status_code != 200:
+            log_error(response)
+            raise client.APIError(response)
+        return True, len(payload), len(body)
+
+    def finish(self, batch, start, end, future):
+        """Account for the oldest batch in flight. Returns False when the run has to stop."""
+        try:
+            accepted, raw_bytes, sent_bytes = future.result()
+        except Exception as e:
+            logger.debug(f"Batch ending at byte {end} failed: {e!r}")
+            return False
+        if not accepted:
+            self.rejected += len(batch)
+        else:
+            self.events += len(batch)
+        self.batches += 1 if batch else 0
+        self.raw_bytes += raw_bytes
+        self.sent_bytes += sent_bytes
+        self.offset = end
+        self.save_checkpoint()
+        return True
+
+    def settle(self, pending):
+        """After a stop: wait for the batches already being sent, and remember the ones that got
+        through so a resumed run skips them."""
+        for batch, start, end, future in pending:
+            if future.cancelled():
+                continue
+            try:
+                accepted, raw_bytes, sent_bytes = future.result()
+            except Exception as e:
+                logger.debug(f"Batch ending at byte {end} failed: {e!r}")
+                continue
+            if accepted:
+                self.events += len(batch)
+            else:
+                self.rejected += len(batch)
+            self.batches += 1 if batch else 0
+            self.raw_bytes += raw_bytes
+            self.sent_bytes += sent_bytes
+            self.sent.append([start, end])
+
+    def run(self, progress=None, task=None):
+        """Send the rest of the file. Returns (ok, seconds, events sent, batches sent) for this run."""
+        started = time.monotonic()
+        events_before, batches_before = self.events, self.batches
+        pending = deque()
+        failed = False
+
+        def report():
+            if progress is not None:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                progress.update(task, completed=self.offset,
+                                description=f"{self.events:,} events, {(self.events - events_before) / elapsed:,.0f} events/s")
+
+        with _open(self.path) as file, ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            start = self.offset
+            try:
+                for batch, end in self.make_batches(file):
+                    pending.append((batch, start, end, executor.submit(self.send, batch)))
+                    start = end
+                    # Keep a bounded number of batches in memory, and settle the ones that are done
+                    while pending and (len(pending) > self.parallel * 2 or pending[0][3].done()):
+                        if not self.finish(*pending.popleft()):
+                            failed = True
+                            break
+                        report()
+                    if failed:
+                        break
+                while pending and not failed:
+                    failed = not self.finish(*pending.popleft())
+                    report()
+            finally:
+                # Also on Ctrl-C: drop the queued batches and keep the progress made so far
+                for _, _, _, future in pending:
+                    future.cancel()
+                self.settle(pending)
+                self.save_checkpoint(force=True)
+        return not failed, time.monotonic() - started, self.events - events_before, self.batches - batches_before
+
+def capture_events(path, api_key=None, batch_size=500, parallel=None, historical=False, restart=False, dry_run=False):
+    """Send the events of an NDJSON or CSV file, resuming an interrupted run of the same file."""
+    if not api_key and not dry_run:
+        api_key = get_api_key(get_headers(), get_credentials().project)
+        if not api_key:
+            logger.error("No project API key, pass --api-key or set PH_PROJECT_API_KEY.")
+            return False
+    capture = Capture(path, api_key or "", PH_CAPTURE_URL or get_url('batch/'), batch_size, parallel,
+                      historical, dry_run)
+    if not restart and not dry_run and capture.load_checkpoint():
+        logger.info(f"Resuming at byte {capture.offset:,} of {capture.identity['size']:,}, "
+                    f"{capture.events:,} events were already sent. Pass --restart to start over.")
+
+    from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
+    console = get_console()
+    # Offsets of a .gz file are in the uncompressed stream, so there is no total to show
+    total = None if path.endswith('.gz') else capture.identity['size']
+    with Progress(TextColumn("{task.description}"), BarColumn(), TransferSpeedColumn(), TimeRemainingColumn(),
+                  console=console, transient=True) as progress:
+        task = progress.add_task("Capturing", total=total, completed=capture.offset)
+        ok, elapsed, events, batches = capture.run(progress, task)
+
+    elapsed = max(elapsed, 1e-6)
+    verb = "Would capture" if dry_run else "Captured"
+    console.print(f"{verb} {events:,} events in {batches:,} batches in {elapsed:.1f}s: "
+                  f"{events / elapsed:,.0f} events/s, {capture.raw_bytes / elapsed / 1e6:.1f} MB/s "
+                  f"({capture.raw_bytes / 1e6:.1f} MB, {capture.sent_bytes / 1e6:.1f} MB gzipped).")
+    if capture.invalid:
+        console.print(f"[yellow]Skipped {capture.invalid:,} invalid lines.[/yellow]")
+    if capture.rejected:
+        console.print(f"[red]{capture.rejected:,} events were rejected by the server.[/red]")
+    if not ok:
+        console.print(f"[red]Stopped at byte {capture.offset:,}; run the same command again to resume.[/red]")
+        return False
+    if not dry_run:
+        capture.clear_checkpoint()
+    return not capture.rejected
@@ -0,0 +1,180 @@
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from ph.utils import trace
+
+logger = logging.getLogger('ph')
+
+PH_HTTP_POOL_SIZE = int(os.environ.get('PH_HTTP_POOL_SIZE', '10'))
+PH_HTTP_CONNECT_TIMEOUT = float(os.environ.get('PH_HTTP_CONNECT_TIMEOUT', '5'))
+PH_HTTP_READ_TIMEOUT = float(os.environ.get('PH_HTTP_READ_TIMEOUT', '30'))
+PH_HTTP_RETRIES = int(os.environ.get('PH_HTTP_RETRIES', '4'))
+PH_HTTP_BACKOFF = float(os.environ.get('PH_HTTP_BACKOFF', '0.5'))
+PH_HTTP_BACKOFF_MAX = float(os.environ.get('PH_HTTP_BACKOFF_MAX', '30'))
+PH_RATE_LIMIT = float(os.environ.get('PH_RATE_LIMIT', '0'))
+PH_RATE_LIMIT_BURST = int(os.environ.get('PH_RATE_LIMIT_BURST', '0'))
+
+# Retrying these methods cannot apply a change twice: PATCH bodies set absolute values. A PATCH with a
+# `version` answers a retry of an already applied change with a 409, update_flag_fields checks for that.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'}
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_session = None
+
+class APIError(Exception):
+    """A request that came back with an unexpected status."""
+
+    def __init__(self, response):
+        super().__init__(f"{response.request.method} {response.url}: {response.status_code}")
+        self.response = response
+
+class ConnectionFailed(APIError):
+    """A request that got no response at all, after its retries."""
+
+    def __init__(self, method, url, error):
+        Exception.__init__(self, f"{method} {url}: {error}")
+        self.response = None
+
+def get_session():
+    """Return the process-wide keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=PH_HTTP_POOL_SIZE, pool_maxsize=PH_HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        _session = session
+    return _session
+
+class RateLimiter:
+    """Token bucket shared by all threads. A 429 pauses every caller until its Retry-After has passed."""
+
+    def __init__(self, rate, burst=0):
+        self.rate = rate
+        self.capacity = max(burst or rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0 and self.rate:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                elif wait <= 0:
+                    return
+            time.sleep(wait)
+
+_rate_limiter = RateLimiter(PH_RATE_LIMIT, PH_RATE_LIMIT_BURST)
+
+def backoff(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(PH_HTTP_BACKOFF_MAX, PH_HTTP_BACKOFF * 2 ** attempt))
+
+def retry_after(response):
+    """Seconds to wait from a Retry-After header (seconds or HTTP date), or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), PH_HTTP_BACKOFF_MAX * 4)
+
+def request(method, url, idempotent=None, **kwargs):
+    """Send a request through the shared session.
+
+    429s, 502/503/504s and connection errors are retried with backoff (Retry-After wins) for idempotent
+    requests. Other requests are only retried when they surely did not reach the server: a 429, or a
+    connect timeout. Raises ConnectionFailed when no response came back."""
+    kwargs.setdefault('allow_redirects', False)
+    kwargs.setdefault('timeout', (PH_HTTP_CONNECT_TIMEOUT, PH_HTTP_READ_TIMEOUT))
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    from requests import ConnectTimeout, RequestException
+    path = urlsplit(url).path
+    with trace.span(f"{method} {path}", "http", method=method, path=path) as span:
+        attempt = 0
+        while True:
+            _rate_limiter.acquire()
+            try:
+                response = get_session().request(method, url, **kwargs)
+            except RequestException as e:
+                if attempt >= PH_HTTP_RETRIES or not (idempotent or isinstance(e, ConnectTimeout)):
+                    span["error"] = str(e)
+                    span["retries"] = attempt
+                    logger.error(f"Request failed: {method} {url}: {e}")
+                    raise ConnectionFailed(method, url, e) from e
+                delay = backoff(attempt)
+                logger.debug(f"{method} {path} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                status = response.status_code
+                if attempt >= PH_HTTP_RETRIES or not (status == 429 or (idempotent and status in RETRY_STATUSES)):
+                    span["retries"] = attempt
+                    if trace.is_enabled():
+                        _trace_response(response, span)
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = backoff(attempt)
+                if status == 429:
+                    _rate_limiter.pause(delay)
+                logger.warning(f"{status} from {method} {path}, retrying in {delay:.1f}s")
+            attempt += 1
+            time.sleep(delay)
+
+def _trace_response(response, span):
+    span["status"] = response.status_code
+    span["bytes"] = int(response.headers.get('Content-Length') or len(response.content))
+    span["ttfb_ms"] = round(response.elapsed.total_seconds() * 1000, 1)
+    span["encoding"] = response.headers.get('Content-Encoding', '')
+    decode = response.json
+
+    def traced_json(**kwargs):
+        with trace.span("json decode", "decode", path=span["path"]):
+            return decode(**kwargs)
+    response.json = traced_json
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def patch(url, **kwargs):
+    return request('PATCH', url, **kwargs)
+
+def log_error(response):
+    """Log a failed response the same way for every command."""
+    if response.status_code == 401:
+        logger.error(f"{response.status_code} Invalid token provided.")
+    elif response.status_code == 302:
+        logger.error(f"Redirection URL: {response.headers.get('Location')}")
+    else:
+        logger.error(f"Error: {response.status_code}")
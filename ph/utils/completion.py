@@ -0,0 +1,110 @@
+"""Shell completion served from local caches.
+
+Completion runs on every <TAB>, so this module only reads small JSON files and never touches the
+network: no requests, inquirer or rich. A stale cache is refreshed by a detached `ph` process.
+"""
+import json
+import os
+import sys
+import time
+from ph.utils.credentials import POSTHOG_DIR, PH_ENDPOINT, get_credentials, write_json_atomic
+
+COMPLETION_DIR = os.path.join(POSTHOG_DIR, 'completion')
+PH_COMPLETION_TTL = int(os.environ.get('PH_COMPLETION_TTL', '600'))
+# A refresh that has not finished after this long is assumed dead and may be started again
+REFRESH_TIMEOUT = 120
+
+def _cache_file():
+    return os.path.join(COMPLETION_DIR, f"{PH_ENDPOINT}.json")
+
+def load_cache():
+    try:
+        with open(_cache_file(), 'r') as file:
+            data = json.load(file)
+            return data if isinstance(data, dict) else {}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _update_cache(**fields):
+    os.makedirs(COMPLETION_DIR, exist_ok=True)
+    data = load_cache()
+    data.update(fields)
+    try:
+        write_json_atomic(_cache_file(), data, durable=False)
+    except OSError:
+        pass
+
+def remember_organizations(organizations):
+    _update_cache(organizations=[{"id": org["id"], "name": org.get("name")} for org in organizations])
+
+def remember_projects(organization, projects):
+    cached = load_cache().get("projects") or {}
+    cached[str(organization)] = [{"id": project["id"], "name": project.get("name")} for project in projects]
+    _update_cache(projects=cached)
+
+def refresh_in_background():
+    """Start a detached `ph` process that refreshes the caches, unless one was started recently."""
+    cache = load_cache()
+    now = time.time()
+    if now - cache.get("refreshed_at", 0) < PH_COMPLETION_TTL or now - cache.get("refresh_started_at", 0) < REFRESH_TIMEOUT:
+        return
+    _update_cache(refresh_started_at=now)
+    import subprocess
+    env = {name: value for name, value in os.environ.items() if name != '_PH_COMPLETE'}
+    try:
+        subprocess.Popen([sys.executable, '-m', 'ph.main', 'completion-refresh'], env=env,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError:
+        pass
+
+def refresh():
+    """Fetch organizations, projects and flag keys of the current project into the caches."""
+    from ph.utils import client, flag_index
+    from ph.utils.auth import get_url
+    from ph.utils.client import APIError
+    from ph.utils.flags import iter_flags
+    from ph.utils.projects import fetch_projects
+    credentials = get_credentials()
+    token = os.environ.get('PH_API_TOKEN') or credentials.token
+    if not token:
+        return False
+    headers = {'Content-Type': 'application/json', "Authorization": "Bearer " + token}
+
+    response = client.get(get_url('api/organizations'), headers=headers)
+    if response.status_code == 200:
+        remember_organizations(response.json().get('results') or [])
+    if credentials.organization:
+        projects = fetch_projects(headers, credentials.organization)
+        if projects is not None:
+            remember_projects(credentials.organization, projects)
+    if credentials.project:
+        try:
+            flags = list(iter_flags(credentials.project, headers))
+        except APIError:
+            return False
+        flag_index.remember_flags(credentials.project, flags)
+        flag_index.retain(credentials.project, {flag['key'] for flag in flags})
+    _update_cache(refreshed_at=time.time())
+    return True
+
+def _matching(values, incomplete):
+    return sorted(value for value in values if value and value.startswith(incomplete))
+
+def complete_flag_keys(ctx, param, incomplete):
+    from ph.utils import flag_index
+    refresh_in_background()
+    project = get_credentials().project
+    if not project:
+        return []
+    return _matching(flag_index.load_index(project), incomplete)
+
+def complete_organizations(ctx, param, incomplete):
+    refresh_in_background()
+    return _matching((org.get("name") for org in load_cache().get("organizations") or []), incomplete)
+
+def complete_projects(ctx, param, incomplete):
+    refresh_in_background()
+    organization = get_credentials().organization
+    projects = (load_cache().get("projects") or {}).get(str(organization)) or []
+    return _matching((project.get("name") for project in projects), incomplete)
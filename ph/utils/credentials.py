@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+from contextlib import contextmanager
+from ph.utils import trace
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger('ph')
+
+POSTHOG_DIR = os.path.expanduser('~/.posthog')
+CREDENTIALS_FILE = os.path.join(POSTHOG_DIR, 'credentials.json')
+PH_ENDPOINT = os.environ.get('PH_ENDPOINT', 'app.dev.posthog.dev')
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on `path`.lock, shared by every ph process on the machine."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def write_json_atomic(path, data, durable=True):
+    """Write to a temp file in the same directory and rename it over `path`."""
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+            if durable:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class Credentials:
+    """Credentials of one endpoint, parsed once per process."""
+
+    def __init__(self, path=CREDENTIALS_FILE, endpoint=PH_ENDPOINT):
+        self.path = path
+        self.endpoint = endpoint
+        self._data = None
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+                return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            with trace.span("credentials load"):
+                self._data = self._read()
+        return self._data
+
+    def _get(self, field):
+        try:
+            return self.data["credentials"][self.endpoint][field]
+        except (KeyError, TypeError):
+            return None
+
+    @property
+    def token(self):
+        return self._get("token")
+
+    @property
+    def organization(self):
+        return self._get("organization")
+
+    @property
+    def project(self):
+        return self._get("project")
+
+    def _update(self, change):
+        """Read-modify-write under the file lock, so concurrent ph processes do not clobber each other."""
+        with file_lock(self.path):
+            data = self._read()
+            change(data)
+            write_json_atomic(self.path, data)
+        self._data = data
+
+    def save(self, token, organization, project):
+        def change(data):
+            credentials = data.setdefault("credentials", {})
+            credentials[self.endpoint] = {"token": token, "organization": organization, "project": project}
+        self._update(change)
+
+    def delete(self):
+        if not os.path.exists(self.path):
+            return
+
+        def change(data):
+            data.get("credentials", {}).pop(self.endpoint, None)
+        self._update(change)
+
+_credentials = None
+
+def get_credentials():
+    global _credentials
+    if _credentials is None:
+        _credentials = Credentials()
+    return _credentials
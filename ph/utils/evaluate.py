@@ -0,0 +1,251 @@
+import hashlib
+from hashlib import sha1
+import json
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from itertools import islice
+
+logger = logging.getLogger('ph')
+
+# Same bucketing as PostHog's server and SDKs: first 15 hex chars of sha1("{key}.{distinct_id}{salt}")
+LONG_SCALE = float(0xFFFFFFFFFFFFFFF)
+CHUNK_SIZE = 20000
+
+class InconclusiveMatchError(Exception):
+    """A condition needs data we do not have locally (missing property, cohorts, ...)."""
+
+def _bucket(digest):
+    # The first 15 hex chars are the top 60 bits of the digest
+    return (int.from_bytes(digest[:8], "big") >> 4) / LONG_SCALE
+
+def _hash(key, distinct_id, salt=""):
+    return _bucket(hashlib.sha1(f"{key}.{distinct_id}{salt}".encode("utf-8")).digest())
+
+def variant_lookup_table(flag):
+    table = []
+    value_min = 0
+    variants = ((flag.get("filters") or {}).get("multivariate") or {}).get("variants") or []
+    for variant in variants:
+        value_max = value_min + variant["rollout_percentage"] / 100
+        table.append((value_min, value_max, variant["key"]))
+        value_min = value_max
+    return table
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) or re.fullmatch(r"-?\d+(\.\d+)?", str(value)) else None
+
+def match_property(prop, properties):
+    key = prop.get("key")
+    operator = prop.get("operator") or "exact"
+    expected = prop.get("value")
+
+    if operator == "is_not_set":
+        return key not in properties
+    if key not in properties:
+        raise InconclusiveMatchError(f"Property {key} is not set")
+    if operator == "is_set":
+        return True
+
+    value = properties[key]
+    if operator in ("exact", "is_not"):
+        options = expected if isinstance(expected, list) else [expected]
+        matches = str(value).lower() in [str(option).lower() for option in options]
+        return matches if operator == "exact" else not matches
+    if operator in ("icontains", "not_icontains"):
+        matches = str(expected).lower() in str(value).lower()
+        return matches if operator == "icontains" else not matches
+    if operator in ("regex", "not_regex"):
+        try:
+            matches = re.search(str(expected), str(value)) is not None
+        except re.error:
+            return False
+        return matches if operator == "regex" else not matches
+    if operator in ("gt", "gte", "lt", "lte"):
+        left, right = _number(value), _number(expected)
+        if left is None or right is None:
+            left, right = str(value), str(expected)
+        return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[operator]
+    raise InconclusiveMatchError(f"Unknown operator {operator}")
+
+class FlagEvaluator:
+    """Evaluates one flag definition for many distinct ids, locally."""
+
+    def __init__(self, flag, properties=None):
+        filters = flag.get("filters") or {}
+        self.key = flag["key"]
+        self.prefix = f"{self.key}.".encode("utf-8")
+        self.active = flag.get("active", True) and not flag.get("deleted")
+        self.properties = properties or {}
+        # Group flags are bucketed on the group key, which a distinct id does not tell us
+        self.group_aggregated = filters.get("aggregation_group_type_index") is not None
+        self.variants = variant_lookup_table(flag)
+        variant_keys = {variant for _, _, variant in self.variants}
+        # Conditions with a variant override are checked first, like the server does
+        groups = sorted(filters.get("groups") or [], key=lambda group: 0 if group.get("variant") else 1)
+
+        # Property filters do not depend on the distinct id, so they are resolved once here.
+        # Each condition becomes (rollout threshold or None, variant override or None).
+        self.conditions = []
+        self.inconclusive = False
+        for group in groups:
+            try:
+                if not self._match_properties(group.get("properties") or []):
+                    continue
+            except InconclusiveMatchError:
+                self.inconclusive = True
+                continue
+            rollout = group.get("rollout_percentage")
+            override = group.get("variant") if group.get("variant") in variant_keys else None
+            self.conditions.append((None if rollout is None else rollout / 100, override))
+
+    def _match_properties(self, properties):
+        for prop in properties:
+            if prop.get("type") == "cohort":
+                raise InconclusiveMatchError("Cohorts can not be evaluated locally")
+            if not match_property(prop, self.properties):
+                return False
+        return True
+
+    def evaluate(self, distinct_id):
+        """True/False, a variant key, or None when the result can not be known locally."""
+        if not self.active:
+            return False
+        if self.group_aggregated:
+            return None
+        bucket = None
+        for threshold, override in self.conditions:
+            if threshold is not None:
+                if bucket is None:
+                    bucket = _bucket(sha1(self.prefix + distinct_id.encode("utf-8")).digest())
+                if bucket > threshold:
+                    continue
+            if override:
+                return override
+            return self._variant(distinct_id) or True
+        return None if self.inconclusive else False
+
+    def _variant(self, distinct_id):
+        if not self.variants:
+            return None
+        bucket = _bucket(sha1(self.prefix + distinct_id.encode("utf-8") + b"variant").digest())
+        for value_min, value_max, variant in self.variants:
+            if value_min <= bucket < value_max:
+                return variant
+        return None
+
+    def evaluate_chunk(self, distinct_ids):
+        return [(distinct_id, self.evaluate(distinct_id)) for distinct_id in distinct_ids]
+
+_worker_evaluator = None
+
+def _init_worker(flag, properties):
+    global _worker_evaluator
+    _worker_evaluator = FlagEvaluator(flag, properties)
+
+def _evaluate_in_worker(distinct_ids):
+    return _worker_evaluator.evaluate_chunk(distinct_ids)
+
+def chunked(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def evaluate_many(flag, distinct_ids, properties=None, workers=None):
+    """Yield result chunks in input order. Chunks are spread over CPU cores once there is more than one."""
+    chunks = chunked(distinct_ids)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    workers = workers or os.cpu_count() or 1
+    if second is None or workers == 1:
+        evaluator = FlagEvaluator(flag, properties)
+        yield evaluator.evaluate_chunk(first)
+        if second is not None:
+            yield evaluator.evaluate_chunk(second)
+            for chunk in chunks:
+                yield evaluator.evaluate_chunk(chunk)
+        return
+
+    from collections import deque
+    from itertools import chain
+    from multiprocessing import Pool
+    with Pool(workers, initializer=_init_worker, initargs=(flag, properties)) as pool:
+        # At most two chunks in flight per worker, so memory stays bounded for any input size
+        pending = deque()
+        for chunk in chain([first, second], chunks):
+            pending.append(pool.apply_async(_evaluate_in_worker, (chunk,)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def read_distinct_ids(path):
+    with (sys.stdin if path == '-' else open(path, 'r')) as file:
+        for line in file:
+            distinct_id = line.strip()
+            if distinct_id:
+                yield distinct_id
+
+def load_definition(key, definitions_path=None):
+    """Read a flag definition from a local JSON/NDJSON file or the synced snapshot, or fetch it once."""
+    if definitions_path:
+        with open(definitions_path, 'r') as file:
+            text = file.read()
+        try:
+            data = json.loads(text)
+            flags = data if isinstance(data, list) else data.get('results', [data])
+        except ValueError:
+            flags = [json.loads(line) for line in text.splitlines() if line.strip()]
+        for flag in flags:
+            if flag.get('key') == key:
+                return flag
+        logger.error(f"Flag not found in {definitions_path}: {key}")
+        return None
+
+    from ph.utils.auth import get_headers
+    from ph.utils.credentials import get_credentials
+    from ph.utils.flags import get_flag
+    from ph.utils import snapshot
+    project_id = get_credentials().project
+    flag = snapshot.find_flag(project_id, key)
+    if flag:
+        return flag
+    return get_flag(project_id, key, get_headers())
+
+def format_value(value):
+    return "inconclusive" if value is None else value
+
+def evaluate_flag(key, distinct_ids, properties=None, definitions_path=None, workers=None,
+                  output_format=None, summary_only=False):
+    """Evaluate a flag for many distinct ids, streaming results and printing exposure stats."""
+    from ph.utils.output import get_writer
+
+    flag = load_definition(key, definitions_path)
+    if not flag:
+        return False
+    if (flag.get("filters") or {}).get("aggregation_group_type_index") is not None:
+        logger.warning(f"{key} is evaluated per group, not per distinct id: every result is inconclusive.")
+
+    writer = None if summary_only else get_writer(output_format, ['distinct_id', 'value'])
+    counts = Counter()
+    total = 0
+    for chunk in evaluate_many(flag, distinct_ids, properties, workers):
+        total += len(chunk)
+        counts.update(format_value(value) for _, value in chunk)
+        if writer:
+            writer.write_rows([(distinct_id, format_value(value)) for distinct_id, value in chunk])
+    if writer:
+        writer.close()
+
+    sys.stderr.write(f"{key}: {total} distinct ids\n")
+    for value, count in counts.most_common():
+        share = 100 * count / total if total else 0
+        sys.stderr.write(f"  {str(value):<20} {count:>12} {share:6.2f}%\n")
+    return True
@@ -0,0 +1,165 @@
+"""Resumable NDJSON exports of large paginated lists (persons, cohort members).
+
+Pages are written in order, and after each one the cursor of the next page and the size of the
+output file are saved to a checkpoint. A run that crashed or was interrupted truncates the file to
+that size and continues from the cursor. When the cursor is an offset, the following pages are
+requested ahead of time on a thread pool; any other cursor is followed one page at a time.
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from ph.utils import client
+from ph.utils.auth import get_headers, get_url
+from ph.utils.client import APIError, log_error
+from ph.utils.credentials import POSTHOG_DIR, get_credentials, write_json_atomic
+from ph.utils.output import dumps, get_console, loads
+
+logger = logging.getLogger('ph')
+
+CHECKPOINT_DIR = os.path.join(POSTHOG_DIR, 'exports')
+
+def checkpoint_path(path):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CHECKPOINT_DIR, f"{digest}.json")
+
+def _params(url):
+    parts = urlsplit(url)
+    return parts, dict(parse_qsl(parts.query))
+
+def _cursor(url):
+    """A comparable form of a page URL: path and sorted query parameters."""
+    parts, params = _params(url)
+    return parts.path.rstrip('/'), sorted(params.items())
+
+def _offset_step(url, next_url):
+    """Offset difference between two consecutive page URLs, or None when the cursor is not an offset."""
+    parts, params = _params(url)
+    next_parts, next_params = _params(next_url)
+    if 'offset' not in next_params or parts.path.rstrip('/') != next_parts.path.rstrip('/'):
+        return None
+    others = {key: value for key, value in params.items() if key != 'offset'}
+    if others != {key: value for key, value in next_params.items() if key != 'offset'}:
+        return None
+    try:
+        step = int(next_params['offset']) - int(params.get('offset', 0))
+    except ValueError:
+        return None
+    return step if step > 0 else None
+
+def _with_offset(url, offset):
+    parts, params = _params(url)
+    params['offset'] = str(offset)
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
+def fetch_page(url, headers):
+    response = client.get(url, headers=headers)
+    if response.status_code != 200:
+        log_error(response)
+        raise APIError(response)
+    return response.json()
+
+def iter_pages(url, headers, ahead=4):
+    """Yield (page, next url) in order. Offset cursors let up to `ahead` pages be fetched at once;
+    a guess is dropped as soon as the server's own `next` disagrees with it."""
+    with ThreadPoolExecutor(max_workers=max(1, ahead)) as executor:
+        pending = deque([(url, executor.submit(fetch_page, url, headers))])
+        try:
+            while pending:
+                page_url, future = pending.popleft()
+                page = future.result()
+                next_url = page.get('next')
+                if not next_url or not page.get('results'):
+                    yield page, None
+                    return
+                if pending and _cursor(pending[0][0]) != _cursor(next_url):
+                    for _, guess in pending:
+                        guess.cancel()
+                    pending.clear()
+                if not pending:
+                    pending.append((next_url, executor.submit(fetch_page, next_url, headers)))
+                step = _offset_step(page_url, next_url)
+                while step and len(pending) < ahead:
+                    guess = _with_offset(pending[-1][0], int(_params(pending[-1][0])[1]['offset']) + step)
+                    pending.append((guess, executor.submit(fetch_page, guess, headers)))
+                yield page, next_url
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def load_checkpoint(path, url):
+    """The saved state of an interrupted export of `url` to `path`, or None to start over."""
+    try:
+        with open(checkpoint_path(path), 'r') as file:
+            state = loads(file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get('url') != url:
+        logger.warning(f"{path} was being exported from another list, starting over.")
+        return None
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = -1
+    if size < state.get('bytes', 0):
+        logger.warning(f"{path} is shorter than when the export was interrupted, starting over.")
+        return None
+    return state
+
+def export_pages(url, path, what, ahead=4, restart=False):
+    """Write every result of a paginated list to an NDJSON file, resuming an interrupted export."""
+    headers = get_headers()
+    state = None if restart else load_checkpoint(path, url)
+    if state:
+        logger.info(f"Resuming the export to {path} after {state['rows']:,} {what}. Pass --restart to start over.")
+    else:
+        state = {"url": url, "next": url, "bytes": 0, "rows": 0}
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+
+    console = get_console()
+    started = time.monotonic()
+    rows_before = state["rows"]
+    from rich.progress import Progress
+    with open(path, 'r+b' if state["bytes"] else 'wb') as file, \
+            Progress(console=console, transient=True) as progress:
+        # Rows written after the last checkpoint are written again from the saved cursor
+        file.truncate(state["bytes"])
+        file.seek(state["bytes"])
+        task = progress.add_task(f"Exporting {what}", total=None)
+        try:
+            for page, next_url in iter_pages(state["next"], headers, ahead):
+                results = page.get('results') or []
+                file.write(b''.join(dumps(row).encode('utf-8') + b'\n' for row in results))
+                file.flush()
+                state.update(next=next_url, bytes=file.tell(), rows=state["rows"] + len(results))
+                if next_url:
+                    write_json_atomic(checkpoint_path(path), state, durable=False)
+                progress.update(task, completed=state["rows"],
+                                description=f"Exporting {what}: {state['rows']:,}")
+        except APIError:
+            console.print(f"[red]Export stopped after {state['rows']:,} {what}; "
+                          f"run the same command again to resume.[/red]")
+            return False
+
+    try:
+        os.remove(checkpoint_path(path))
+    except FileNotFoundError:
+        pass
+    elapsed = max(time.monotonic() - started, 1e-6)
+    exported = state["rows"] - rows_before
+    console.print(f"Exported {state['rows']:,} {what} to {path} "
+                  f"({exported / elapsed:,.0f} {what}/s over {elapsed:.1f}s).")
+    return True
+
+def export_persons(path, page_size=100, ahead=4, restart=False):
+    project_id = get_credentials().project
+    url = get_url(f'api/projects/{project_id}/persons/') + f"?{urlencode({'limit': page_size})}"
+    return export_pages(url, path, "persons", ahead, restart)
+
+def export_cohort(cohort_id, path, page_size=100, ahead=4, restart=False):
+    project_id = get_credentials().project
+    url = get_url(f'api/projects/{project_id}/cohorts/{cohort_id}/persons/') + f"?{urlencode({'limit': page_size})}"
+    return export_pages(url, path, "persons", ahead, restart)
@@ -0,0 +1,122 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from ph.utils import trace
+from ph.utils.credentials import POSTHOG_DIR, PH_ENDPOINT, file_lock, write_json_atomic
+
+logger = logging.getLogger('ph')
+
+INDEX_DIR = os.path.join(POSTHOG_DIR, 'flag_index')
+PH_FLAG_INDEX_TTL = int(os.environ.get('PH_FLAG_INDEX_TTL', '3600'))
+
+_indexes = {}
+# project id -> {key: (time, entry or None when removed)} changed by this process
+_changes = {}
+_lock = threading.RLock()
+
+def _index_file(project_id):
+    return os.path.join(INDEX_DIR, f"{PH_ENDPOINT}_{project_id}.json")
+
+def _read_index(project_id):
+    try:
+        with open(_index_file(project_id), 'r') as file:
+            return json.load(file).get("flags", {})
+    except (FileNotFoundError, ValueError, AttributeError):
+        return {}
+
+def load_index(project_id):
+    """Load the key -> id index of a project, once per process."""
+    with _lock:
+        if project_id not in _indexes:
+            with trace.span("flag index load"):
+                _indexes[project_id] = _read_index(project_id)
+        return _indexes[project_id]
+
+def _changed(project_id, key, entry):
+    _changes.setdefault(project_id, {})[key] = (time.time(), entry)
+
+def merge_changes(index, changes):
+    """Apply this process's changes on top of the index on disk. Another process may have saved a
+    newer entry for the same key since: the most recently fetched one wins."""
+    for key, (changed_at, entry) in changes.items():
+        current = index.get(key)
+        newer = current is not None and current.get("fetched_at", 0) > changed_at
+        if entry is None and not newer:
+            index.pop(key, None)
+        elif entry is not None and (current is None or current.get("fetched_at", 0) <= entry.get("fetched_at", 0)):
+            index[key] = entry
+    return index
+
+def save_index(project_id):
+    with _lock:
+        changes = _changes.pop(project_id, {})
+    if not changes:
+        return
+    path = _index_file(project_id)
+    try:
+        # Re-read under the lock so entries saved by concurrent ph processes are kept
+        with trace.span("flag index save", entries=len(changes)), file_lock(path):
+            index = merge_changes(_read_index(project_id), changes)
+            write_json_atomic(path, {"flags": index}, durable=False)
+    except OSError as e:
+        logger.debug(f"Could not save flag index: {e}")
+
+@atexit.register
+def flush():
+    """Write every index changed by this process. Changes are batched until exit (or an explicit flush)."""
+    for project_id in list(_changes):
+        save_index(project_id)
+
+def lookup(project_id, key):
+    """Return the cached entry of a flag key, or None."""
+    return load_index(project_id).get(key)
+
+def is_fresh(entry):
+    return time.time() - entry.get("fetched_at", 0) < PH_FLAG_INDEX_TTL
+
+def remember_flags(project_id, flags, etag=None):
+    """Record key -> id (plus version/updated_at) for flags returned by the API."""
+    index = load_index(project_id)
+    now = time.time()
+    with _lock:
+        for flag in flags:
+            if flag.get("deleted"):
+                index.pop(flag.get("key"), None)
+                _changed(project_id, flag.get("key"), None)
+                continue
+            index[flag["key"]] = {
+                "id": flag["id"],
+                "version": flag.get("version"),
+                "updated_at": flag.get("updated_at"),
+                "etag": etag,
+                "fetched_at": now,
+            }
+            _changed(project_id, flag["key"], index[flag["key"]])
+
+def remember_flag(project_id, flag, etag=None):
+    remember_flags(project_id, [flag], etag)
+
+def touch(project_id, key):
+    """Mark an entry as revalidated."""
+    entry = lookup(project_id, key)
+    if entry:
+        with _lock:
+            entry["fetched_at"] = time.time()
+            _changed(project_id, key, entry)
+
+def forget_flag(project_id, key):
+    index = load_index(project_id)
+    with _lock:
+        if index.pop(key, None) is not None:
+            _changed(project_id, key, None)
+
+def retain(project_id, keys):
+    """Drop every entry whose key is not in `keys`, after a full listing of the project."""
+    index = load_index(project_id)
+    with _lock:
+        for key in [key for key in index if key not in keys]:
+            index.pop(key)
+            _changed(project_id, key, None)
@@ -1,74 +1,187 @@
-import json
-import inquirer
-import requests
-from ph.utils.auth import get_headers, get_url, read_project_from_file
+import copy
+from itertools import islice
+from ph.utils import client, flag_index, snapshot
+from ph.utils.auth import get_headers, get_url
+from ph.utils.credentials import get_credentials
+from ph.utils.client import APIError, log_error
+from ph.utils.output import get_writer, print_document
 import logging
-from rich.console import Console
+logger = logging.getLogger('ph')
 
-console = Console()
+PAGE_SIZE = 100
+DEFAULT_FIELDS = ['id', 'key', 'name', 'active', 'rollout_percentage']
 
-logger = logging.getLogger('ph')
+def _fetch_page(url, headers, params):
+    response = client.get(url, headers=headers, params=params)
+    if response.status_code != 200:
+        log_error(response)
+        raise APIError(response)
+    return response.json()
 
-def list_flags():
-    """List flags."""
-    headers = get_headers()
-    project_id = read_project_from_file()
+def iter_flag_pages(project_id, headers, page_size=PAGE_SIZE, params=None):
+    """Yield pages of flags following the `next` cursor, fetching the next page in the background."""
+    from concurrent.futures import ThreadPoolExecutor
     url = get_url(f'api/projects/{project_id}/feature_flags')
-    response = requests.get(url, headers=headers, allow_redirects=False)
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get('results')
-
-        if not results:
-            logger.info("No flags found.")
-            return
-
-        display_to_id = {option['key']: option['id'] for option in results}
-        choices = list(display_to_id.keys())
-
-        questions = [
-            inquirer.List('select_flag',
-                        message="Select flag",
-                        choices=choices,
-                        ),
-        ]
-        answers = inquirer.prompt(questions)
-        selected_display = answers.get('select_flag')
-        selected_id = display_to_id[selected_display]
-        logger.debug(f"Selected flag: {selected_display}: {selected_id}")
-        load_flag(selected_id)
-    else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
+    params = {"limit": page_size, **(params or {})}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(_fetch_page, url, headers, params)
+        while future:
+            data = future.result()
+            next_url = data.get('next')
+            future = executor.submit(_fetch_page, next_url, headers, None) if next_url else None
+            yield data.get('results') or []
+
+def iter_flags(project_id, headers, page_size=PAGE_SIZE, params=None):
+    for page in iter_flag_pages(project_id, headers, page_size, params):
+        yield from page
+
+def flag_field(flag, field):
+    """Read a (dotted) field of a flag. `rollout_percentage` falls back to the first condition group."""
+    if field == 'rollout_percentage' and flag.get(field) is None:
+        groups = (flag.get('filters') or {}).get('groups') or []
+        return groups[0].get('rollout_percentage') if groups else None
+    value = flag
+    for part in field.split('.'):
+        if isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        elif isinstance(value, dict):
+            value = value.get(part)
         else:
-            logger.error(f"Error: {response.status_code}")
+            return None
+    return value
+
+def list_flags(limit=None, fields=None, interactive=True, output_format=None, offline=False):
+    """List flags."""
+    if offline:
+        print_snapshot_flags(get_credentials().project, limit, fields or DEFAULT_FIELDS, output_format)
+        return
+
+    headers = get_headers()
+    project_id = get_credentials().project
+
+    if not interactive:
+        try:
+            print_flags(project_id, headers, limit, fields or DEFAULT_FIELDS, output_format)
+        except APIError:
+            pass
+        return
+
+    flags = []
+    try:
+        for page in iter_flag_pages(project_id, headers):
+            flag_index.remember_flags(project_id, page)
+            flags.extend(page[:limit - len(flags)] if limit else page)
+            if limit and len(flags) >= limit:
+                break
+    except APIError:
+        return
+
+    if not flags:
+        logger.info("No flags found.")
+        return
+
+    from ph.utils.search import SearchIndex, pick_flag
+    selected = pick_flag(SearchIndex(flags))
+    if selected:
+        logger.debug(f"Selected flag: {selected['key']}: {selected['id']}")
+        load_flag(selected['id'])
+
+def print_flags(project_id, headers, limit, fields, output_format):
+    """Stream flags to stdout page by page."""
+    writer = get_writer(output_format, fields)
+    count = 0
+    for page in iter_flag_pages(project_id, headers):
+        flag_index.remember_flags(project_id, page)
+        if limit:
+            page = page[:limit - count]
+        writer.write_rows([[flag_field(flag, field) for field in fields] for flag in page])
+        count += len(page)
+        if limit and count >= limit:
+            break
+    writer.close()
+
+    if not count:
+        logger.info("No flags found.")
+
+def print_snapshot_flags(project_id, limit, fields, output_format):
+    """Print flags from the local snapshot, without any request."""
+    if not snapshot.has_snapshot(project_id):
+        logger.error("No local snapshot, run `ph flags sync` first.")
+        return
+    writer = get_writer(output_format, fields)
+    flags = snapshot.read_snapshot(snapshot.snapshot_path(project_id))
+    rows = []
+    for flag in islice(flags, limit):
+        rows.append([flag_field(flag, field) for field in fields])
+        if len(rows) >= PAGE_SIZE:
+            writer.write_rows(rows)
+            rows = []
+    writer.write_rows(rows)
+    writer.close()
+
+PROJECT_FIELDS = ['project_id', 'project']
+
+def print_projects_flags(projects, headers, limit, fields, output_format, parallel=None):
+    """Stream the flags of several projects, queried concurrently, tagged with their project."""
+    from ph.utils.projects import stream_projects
+    writer = get_writer(output_format, PROJECT_FIELDS + fields)
+
+    def iter_pages(project):
+        count = 0
+        for page in iter_flag_pages(project['id'], headers):
+            flag_index.remember_flags(project['id'], page)
+            if limit:
+                page = page[:limit - count]
+            count += len(page)
+            yield page
+            if limit and count >= limit:
+                return
+
+    ok = True
+    for project, page, error in stream_projects(projects, iter_pages, parallel):
+        if error:
+            ok = False
+            logger.error(f"Listing flags of project {project['name']} failed.")
+            continue
+        writer.write_rows([[project['id'], project['name']] + [flag_field(flag, field) for field in fields]
+                           for flag in page])
+    writer.close()
+    return ok
+
+def show_projects_flag(projects, key, headers, fields, output_format, parallel=None):
+    """Look a flag key up in several projects concurrently and print one row per project."""
+    from ph.utils.projects import stream_projects
+    writer = get_writer(output_format, PROJECT_FIELDS + ['found'] + fields)
+
+    def iter_pages(project):
+        yield [get_flag(project['id'], key, headers, log_missing=False)]
+
+    ok = True
+    for project, page, error in stream_projects(projects, iter_pages, parallel):
+        if error:
+            ok = False
+            logger.error(f"Looking up {key} in project {project['name']} failed.")
+            continue
+        flag = page[0]
+        values = [flag_field(flag, field) for field in fields] if flag else [None] * len(fields)
+        writer.write_rows([[project['id'], project['name'], flag is not None] + values])
+    writer.close()
+    return ok
 
 def load_flag(id):
     """Load flag."""
     headers = get_headers()
-    project_id = read_project_from_file()
+    project_id = get_credentials().project
     url = get_url(f'api/projects/{project_id}/feature_flags/{id}')
-    response = requests.get(url, headers=headers, allow_redirects=False)
+    response = client.get(url, headers=headers)
     if response.status_code == 200:
-        data = response.json()
-        console.print(f"Flag data: {json.dumps(data, indent=4)}")
+        print_document(response.json())
     else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
-
-def create_flag(key, description, rollout_percentage):
-    """Create flag."""
-    headers = get_headers()
-    project_id = read_project_from_file()
-    url = get_url(f'api/projects/{project_id}/feature_flags')
+        log_error(response)
 
-    data = {
+def build_flag(key, description, rollout_percentage):
+    """Payload for a new flag with a single condition group."""
+    return {
         "key": key,
         "name": description,
         "filters": {
@@ -97,159 +210,212 @@ def create_flag(key, description, rollout_percentage):
         "tags": []
         }
 
-    response = requests.post(url, headers=headers, json=data, allow_redirects=False)
+def create_flag(key, description, rollout_percentage, project_id=None, headers=None, **fields):
+    """Create flag."""
+    headers = headers or get_headers()
+    project_id = project_id or get_credentials().project
+    url = get_url(f'api/projects/{project_id}/feature_flags')
+
+    data = build_flag(key, description, rollout_percentage)
+    data.update(fields)
+
+    response = client.post(url, headers=headers, json=data)
     if response.status_code == 201:
+        flag_index.remember_flag(project_id, response.json())
         logger.info(f"Flag created: {key}")
-    else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
+        return True
+    log_error(response)
+    return False
 
-def delete_flag(key):
-    """Delete flag."""
-    headers = get_headers()
-    project_id = read_project_from_file()
+def lookup_flag(project_id, key, headers, log_missing=True):
+    """Find a flag by key with a targeted search instead of the full list."""
     url = get_url(f'api/projects/{project_id}/feature_flags')
-    response = requests.get(url, headers=headers, allow_redirects=False)
-    if response.status_code == 200:
+    params = {"search": key}
+    while url:
+        response = client.get(url, headers=headers, params=params)
+        if response.status_code != 200:
+            log_error(response)
+            return None
         data = response.json()
-        results = data.get('results')
+        results = data.get('results') or []
+        flag_index.remember_flags(project_id, results)
+        for flag in results:
+            if flag['key'] == key:
+                return flag
+        url = data.get('next')
+        params = None
 
-        display_to_id = {option['key']: option['id'] for option in results}
-        try:
-            id = display_to_id[key]
-        except KeyError:
-            logger.error(f"Flag not found: {key}")
-            return
-
-        data = {
-            "name": key,
-            "id": id,
-            "deleted": True
-            }
+    if log_missing:
+        logger.error(f"Flag not found: {key}")
+    return None
+
+def get_flag(project_id, key, headers, log_missing=True):
+    """Return the full flag record for a key, using the local index when possible."""
+    entry = flag_index.lookup(project_id, key)
+    if entry:
+        url = get_url(f'api/projects/{project_id}/feature_flags/{entry["id"]}')
+        response = client.get(url, headers=headers)
+        if response.status_code == 200:
+            flag = response.json()
+            if flag.get('key') == key and not flag.get('deleted'):
+                flag_index.remember_flag(project_id, flag, response.headers.get('ETag'))
+                return flag
+        elif response.status_code != 404:
+            log_error(response)
+            return None
+        flag_index.forget_flag(project_id, key)
+    return lookup_flag(project_id, key, headers, log_missing)
 
-        url = get_url(f'api/projects/{project_id}/feature_flags/{id}')
-        response = requests.patch(url, headers=headers, allow_redirects=False, json=data)
+def resolve_flag_id(project_id, key, headers):
+    """Turn a flag key into its id, revalidating stale index entries."""
+    entry = flag_index.lookup(project_id, key)
+    if entry and flag_index.is_fresh(entry):
+        return entry['id']
 
+    if entry:
+        flag_headers = dict(headers)
+        if entry.get('etag'):
+            flag_headers['If-None-Match'] = entry['etag']
+        url = get_url(f'api/projects/{project_id}/feature_flags/{entry["id"]}')
+        response = client.get(url, headers=flag_headers)
+        if response.status_code == 304:
+            flag_index.touch(project_id, key)
+            return entry['id']
         if response.status_code == 200:
-            logger.info(f"Flag deleted: {key}")
-        else:
-            if response.status_code == 401:
-                logger.error(f"{response.status_code} Invalid token provided.")
-            elif response.status_code == 302:
-                logger.error(f"Redirection URL: {response.headers.get('Location')}")
-            else:
-                logger.error(f"Error: {response.status_code}")
-    else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
+            flag = response.json()
+            if flag.get('key') == key and not flag.get('deleted'):
+                flag_index.remember_flag(project_id, flag, response.headers.get('ETag'))
+                return flag['id']
+        elif response.status_code != 404:
+            log_error(response)
+            return None
+        flag_index.forget_flag(project_id, key)
 
-def disable_flag(key, status):
-    """Disable flag."""
-    headers = get_headers()
-    project_id = read_project_from_file()
-    url = get_url(f'api/projects/{project_id}/feature_flags')
-    response = requests.get(url, headers=headers, allow_redirects=False)
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get('results')
+    flag = lookup_flag(project_id, key, headers)
+    return flag['id'] if flag else None
 
-        display_to_id = {option['key']: option['id'] for option in results}
-        try:
-            id = display_to_id[key]
-        except KeyError:
-            logger.error(f"Flag not found: {key}")
-            return
+def patch_flag(project_id, key, data, headers, flag_id=None):
+    """PATCH a flag by key. A cached id that no longer exists is looked up once more."""
+    if flag_id is None:
+        flag_id = resolve_flag_id(project_id, key, headers)
+        if flag_id is None:
+            return None
 
-        data = {"active": status}
+    url = get_url(f'api/projects/{project_id}/feature_flags/{flag_id}')
+    response = client.patch(url, headers=headers, json=data)
+    if response.status_code == 404:
+        flag_index.forget_flag(project_id, key)
+        flag = lookup_flag(project_id, key, headers)
+        if not flag:
+            return None
+        url = get_url(f'api/projects/{project_id}/feature_flags/{flag["id"]}')
+        response = client.patch(url, headers=headers, json=data)
+    return response
 
-        url = get_url(f'api/projects/{project_id}/feature_flags/{id}')
-        response = requests.patch(url, headers=headers, allow_redirects=False, json=data)
+def delete_flag(key, project_id=None, headers=None, flag_id=None):
+    """Delete flag."""
+    headers = headers or get_headers()
+    project_id = project_id or get_credentials().project
 
-        if response.status_code == 200:
-            logger.info(f"Flag updated: {key}")
-        else:
-            if response.status_code == 401:
-                logger.error(f"{response.status_code} Invalid token provided.")
-            elif response.status_code == 302:
-                logger.error(f"Redirection URL: {response.headers.get('Location')}")
-            else:
-                logger.error(f"Error: {response.status_code}")
-    else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
+    data = {
+        "name": key,
+        "deleted": True
+        }
 
+    response = patch_flag(project_id, key, data, headers, flag_id=flag_id)
+    if response is None:
+        return False
 
-def show_flag(key):
-    """Show flag."""
-    headers = get_headers()
-    project_id = read_project_from_file()
-    url = get_url(f'api/projects/{project_id}/feature_flags')
-    response = requests.get(url, headers=headers, allow_redirects=False)
     if response.status_code == 200:
-        data = response.json()
-        results = data.get('results')
+        flag_index.forget_flag(project_id, key)
+        logger.info(f"Flag deleted: {key}")
+        return True
+    log_error(response)
+    return False
 
-        display_to_id = {option['key']: option for option in results}
-        try:
-            flag = display_to_id[key]
-            console.print(json.dumps(flag, indent=4))
-        except KeyError:
-            logger.error(f"Flag not found: {key}")
-            return
-
-def update_flag(key, description, rollout_percentage):
-    """Update flag."""
-    headers = get_headers()
-    project_id = read_project_from_file()
-    url = get_url(f'api/projects/{project_id}/feature_flags')
-    response = requests.get(url, headers=headers, allow_redirects=False)
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get('results')
+def update_flag_fields(key, changes, project_id=None, headers=None, flag_id=None):
+    """PATCH only the given fields of a flag."""
+    headers = headers or get_headers()
+    project_id = project_id or get_credentials().project
 
-        display_to_id = {option['key']: option for option in results}
-        try:
-            data = display_to_id[key]
-        except KeyError:
-            logger.error(f"Flag not found: {key}")
-            return
+    response = patch_flag(project_id, key, changes, headers, flag_id=flag_id)
+    if response is None:
+        return False
 
-        if description:
-            data["name"] = description
+    if response.status_code == 200:
+        flag_index.remember_flag(project_id, response.json())
+        logger.info(f"Flag updated: {key}")
+        return True
+    if response.status_code == 409:
+        # A retried PATCH whose first attempt was applied (and its response lost) conflicts with itself
+        flag = get_flag(project_id, key, headers)
+        if flag and is_applied(flag, changes):
+            logger.info(f"Flag updated: {key}")
+            return True
+        logger.error(f"Flag {key} was changed by someone else since it was read, nothing was updated.")
+        return False
+    log_error(response)
+    return False
 
-        if rollout_percentage:
-            data["filters"]["groups"][0]["rollout_percentage"] = rollout_percentage
+def is_applied(flag, changes):
+    """True when the flag already has every changed field, ignoring empty server defaults."""
+    from ph.utils.apply import normalize
+    return all(normalize(flag.get(field)) == normalize(value) for field, value in changes.items() if field != "version")
 
-        id = data['id']
+def disable_flag(key, status, project_id=None, headers=None, flag_id=None):
+    """Disable flag."""
+    return update_flag_fields(key, {"active": status}, project_id, headers, flag_id)
 
-        url = get_url(f'api/projects/{project_id}/feature_flags/{id}')
-        response = requests.patch(url, headers=headers, allow_redirects=False, json=data)
 
-        if response.status_code == 200:
-            logger.info(f"Flag updated: {key}")
-        else:
-            if response.status_code == 401:
-                logger.error(f"{response.status_code} Invalid token provided.")
-            elif response.status_code == 302:
-                logger.error(f"Redirection URL: {response.headers.get('Location')}")
-            else:
-                logger.error(f"Error: {response.status_code}")
+def show_flag(key, offline=False):
+    """Show flag."""
+    project_id = get_credentials().project
+    if offline:
+        flag = snapshot.find_flag(project_id, key)
+        if not flag:
+            logger.error(f"Flag not found in the local snapshot: {key}")
     else:
-        if response.status_code == 401:
-            logger.error(f"{response.status_code} Invalid token provided.")
-        elif response.status_code == 302:
-            logger.error(f"Redirection URL: {response.headers.get('Location')}")
-        else:
-            logger.error(f"Error: {response.status_code}")
+        flag = get_flag(project_id, key, get_headers())
+    if flag:
+        print_document(flag)
+    return flag is not None
+
+def update_changes(flag, description=None, rollout_percentage=None, group=0):
+    """Only the fields that change, plus the version they were computed from.
+
+    The server rejects the PATCH with a 409 when the flag got a newer version in the meantime."""
+    changes = {}
+    if description and description != flag.get("name"):
+        changes["name"] = description
+    if rollout_percentage is not None:
+        filters = copy.deepcopy(flag.get("filters") or {})
+        groups = filters.get("groups") or []
+        if not groups and group == 0:
+            groups.append({"properties": [], "variant": None})
+        if group >= len(groups):
+            raise ValueError(f"Flag {flag['key']} has {len(groups)} condition groups, there is no group {group}")
+        if groups[group].get("rollout_percentage") != rollout_percentage:
+            groups[group]["rollout_percentage"] = rollout_percentage
+            filters["groups"] = groups
+            changes["filters"] = filters
+    if changes and flag.get("version") is not None:
+        changes["version"] = flag["version"]
+    return changes
+
+def update_flag(key, description, rollout_percentage, project_id=None, headers=None, group=0):
+    """Update the name and/or the rollout of one condition group, sending only what changed."""
+    headers = headers or get_headers()
+    project_id = project_id or get_credentials().project
+    flag = get_flag(project_id, key, headers)
+    if not flag:
+        return False
+
+    try:
+        changes = update_changes(flag, description, rollout_percentage, group)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    if not changes:
+        logger.info(f"No changes to be made for flag: {key}")
+        return True
+    return update_flag_fields(key, changes, project_id, headers, flag_id=flag['id'])
@@ -0,0 +1,293 @@
+"""Local journal of deferred flag mutations, pushed later by `ph sync flush`.
+
+`--defer` appends one line per mutation and returns without a request. A flush collapses the
+operations of each flag into the fewest writes that reach the same end state (disable then enable is
+one `active` change, create then delete is nothing) and sends them with one worker per flag.
+
+Appends and the flush share a lock file. A flush first moves the journal aside, so mutations deferred
+while it runs go to a fresh journal; operations that failed are written back in front of them. Every
+write that went through is recorded in a progress file as it completes, so the flush after a crash
+only replays what was not sent yet.
+"""
+import logging
+import os
+import threading
+import time
+from ph.utils.credentials import POSTHOG_DIR, PH_ENDPOINT, file_lock, get_credentials
+from ph.utils.output import dumps, loads
+
+logger = logging.getLogger('ph')
+
+JOURNAL_DIR = os.path.join(POSTHOG_DIR, 'journal')
+
+def journal_path():
+    return os.path.join(JOURNAL_DIR, f"{PH_ENDPOINT}.ndjson")
+
+def _flushing_path():
+    return journal_path() + '.flushing'
+
+def _progress_path():
+    return journal_path() + '.progress'
+
+def _locked():
+    return file_lock(journal_path())
+
+def _entry_id(entry):
+    return f"{entry['project']}:{entry['key']}:{entry['op']}:{entry['at']}"
+
+def _read(path):
+    try:
+        with open(path, 'rb') as file:
+            return [loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def _write(path, entries):
+    if entries:
+        with open(path + '.tmp', 'wb') as file:
+            file.write(b''.join(dumps(entry).encode('utf-8') + b'\n' for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def _append(path, data):
+    """One fsynced O_APPEND write of a JSON line."""
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, dumps(data).encode('utf-8') + b'\n')
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def record(project_id, op, key, **fields):
+    """Append one mutation to the journal."""
+    entry = {"op": op, "project": project_id, "key": key, "at": time.time()}
+    entry.update({name: value for name, value in fields.items() if value is not None})
+    with _locked():
+        _append(journal_path(), entry)
+
+def replay_progress(entries, progress):
+    """The entries of an interrupted flush minus what it sent. Each progress record replaces the
+    entries left of one flag with the ones still to send after a step went through."""
+    for change in progress:
+        replaced = set(change["replaced"])
+        positions = [i for i, entry in enumerate(entries) if _entry_id(entry) in replaced]
+        at = positions[0] if positions else len(entries)
+        entries = [entry for entry in entries if _entry_id(entry) not in replaced]
+        entries[at:at] = change["with"]
+    return entries
+
+def _unsent():
+    """Entries of an interrupted flush that were not sent."""
+    return replay_progress(_read(_flushing_path()), _read(_progress_path()))
+
+def defer(op, keys, **fields):
+    """Journal a mutation of flags of the current project instead of sending it."""
+    project_id = get_credentials().project
+    for key in keys:
+        record(project_id, op, key, **fields)
+    logger.info(f"Deferred {op}: {', '.join(keys)}. Run `ph sync flush` to send it.")
+    return True
+
+def pending():
+    return _unsent() + _read(journal_path())
+
+def clear():
+    """Drop every deferred mutation. Returns how many there were."""
+    with _locked():
+        count = len(pending())
+        _write(_flushing_path(), [])
+        _write(_progress_path(), [])
+        _write(journal_path(), [])
+    return count
+
+class FlagPlan:
+    """End state of one flag after its journal entries, as at most one delete, create and update."""
+
+    def __init__(self, project, key):
+        self.project = project
+        self.key = key
+        self.delete = False
+        self.create = None
+        self.changes = {}
+        self.entries = []
+
+    def add(self, entry):
+        self.entries.append(entry)
+        op = entry["op"]
+        if op == 'create':
+            self.create = {"description": entry.get("description") or "",
+                           "rollout_percentage": entry.get("rollout_percentage", 100)}
+            self.changes = {}
+        elif op == 'delete':
+            # A flag created in the journal never has to reach the server
+            if self.create is None:
+                self.delete = True
+            self.create = None
+            self.changes = {}
+        elif op in ('enable', 'disable'):
+            self.changes["active"] = op == 'enable'
+        elif op == 'update':
+            if entry.get("description"):
+                self.changes["description"] = entry["description"]
+            if entry.get("rollout_percentage") is not None:
+                self.changes.setdefault("rollouts", {})[entry.get("group", 0)] = entry["rollout_percentage"]
+
+    def steps(self):
+        """The writes to send, in order: delete, create, update."""
+        steps = []
+        changes = dict(self.changes)
+        if self.delete:
+            steps.append(('delete', {}))
+        if self.create is not None:
+            create = dict(self.create)
+            if changes.get("description"):
+                create["description"] = changes.pop("description")
+            rollouts = dict(changes.pop("rollouts", {}))
+            if 0 in rollouts:
+                create["rollout_percentage"] = rollouts.pop(0)
+            if "active" in changes:
+                create["active"] = changes.pop("active")
+            if rollouts:
+                changes["rollouts"] = rollouts
+            steps.append(('create', create))
+        if changes:
+            steps.append(('update', changes))
+        return steps
+
+def collapse(entries):
+    """FlagPlans per (project, key), in the order the flags first appear."""
+    plans = {}
+    for entry in entries:
+        plan = plans.get((entry["project"], entry["key"]))
+        if plan is None:
+            plan = plans[(entry["project"], entry["key"])] = FlagPlan(entry["project"], entry["key"])
+        plan.add(entry)
+    return list(plans.values())
+
+def apply_update(project_id, headers, key, changes):
+    """Send the update of a plan, computed against the current flag so unchanged fields are skipped."""
+    from ph.utils.flags import get_flag, update_changes, update_flag_fields
+    flag = get_flag(project_id, key, headers)
+    if not flag:
+        return False
+    try:
+        patch = update_changes(flag, changes.get("description"))
+        current = flag
+        for group, rollout_percentage in sorted(changes.get("rollouts", {}).items(), key=lambda item: int(item[0])):
+            current = dict(current, **patch)
+            patch.update(update_changes(current, None, rollout_percentage, int(group)))
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    if "active" in changes and changes["active"] != flag.get("active"):
+        patch["active"] = changes["active"]
+        if flag.get("version") is not None:
+            patch["version"] = flag["version"]
+    if not patch:
+        logger.info(f"No changes to be made for flag: {key}")
+        return True
+    return update_flag_fields(key, patch, project_id, headers, flag_id=flag['id'])
+
+def step_entries(plan, steps):
+    """Journal entries that replay the given steps of a plan."""
+    entries = []
+    for op, fields in steps:
+        base = {"project": plan.project, "key": plan.key, "at": time.time()}
+        if op in ('delete', 'create'):
+            entries.append(dict(base, op=op, **{name: fields[name] for name in ('description', 'rollout_percentage')
+                                                if name in fields}))
+        else:
+            if fields.get("description"):
+                entries.append(dict(base, op='update', description=fields["description"]))
+            for group, rollout_percentage in fields.get("rollouts", {}).items():
+                entries.append(dict(base, op='update', rollout_percentage=rollout_percentage, group=group))
+        if "active" in fields:
+            entries.append(dict(base, op='enable' if fields["active"] else 'disable'))
+    return entries
+
+def apply_plan(plan, headers, on_step=None):
+    """Send the steps of a plan in order. Returns the entries still to replay, empty when all went through.
+    on_step(sent entries, entries left) is called after every step that went through."""
+    from ph.utils.flags import create_flag, delete_flag
+    steps = plan.steps()
+    sent = plan.entries
+    for i, (op, fields) in enumerate(steps):
+        if op == 'delete':
+            ok = delete_flag(plan.key, plan.project, headers)
+        elif op == 'create':
+            fields = dict(fields)
+            ok = create_flag(plan.key, fields.pop("description"), fields.pop("rollout_percentage"),
+                             plan.project, headers, **fields)
+        else:
+            ok = apply_update(plan.project, headers, plan.key, fields)
+        if not ok:
+            return plan.entries if i == 0 else step_entries(plan, steps[i:])
+        left = step_entries(plan, steps[i + 1:])
+        if on_step:
+            on_step(sent, left)
+        sent = left
+    return []
+
+def flush(parallel=None, dry_run=False):
+    """Collapse the journal and push it, one worker per flag. Failed flags stay in the journal."""
+    from ph.utils.output import get_console
+    console = get_console()
+    # Held for the whole flush, so a second flush cannot send the entries being sent again
+    with file_lock(_flushing_path()):
+        return _flush(console, parallel, dry_run)
+
+def _flush(console, parallel, dry_run):
+    with _locked():
+        entries = _unsent() + _read(journal_path())
+        if not dry_run:
+            _write(_flushing_path(), entries)
+            _write(_progress_path(), [])
+            _write(journal_path(), [])
+    if not entries:
+        console.print("Nothing to flush.")
+        return True
+
+    plans = collapse(entries)
+    writes = sum(len(plan.steps()) for plan in plans)
+    if dry_run:
+        for plan in plans:
+            for op, fields in plan.steps() or [('nothing', {})]:
+                details = ", ".join(f"{name}={value}" for name, value in fields.items())
+                console.print(f"{op} {plan.key}" + (f" ({details})" if details else ""))
+        console.print(f"{len(entries)} journal entries, {writes} writes after collapsing.")
+        return True
+
+    from ph.utils.auth import get_headers
+    from ph.utils.workers import run_parallel
+    headers = get_headers()
+    progress_lock = threading.Lock()
+    # Entries still to send per plan after its last step that went through
+    unsent = {id(plan): plan.entries for plan in plans}
+
+    def send(plan):
+        def on_step(sent, left):
+            with progress_lock:
+                _append(_progress_path(), {"replaced": [_entry_id(entry) for entry in sent], "with": left})
+                unsent[id(plan)] = left
+        return apply_plan(plan, headers, on_step)
+    left_by_plan = {}
+    for plan, left, error in run_parallel(plans, send, parallel):
+        if left or error:
+            # A step that raised keeps what the steps before it already sent
+            left_by_plan[id(plan)] = unsent[id(plan)] if error else left
+    failed = [plan for plan in plans if id(plan) in left_by_plan]
+    remaining = [entry for plan in failed for entry in left_by_plan[id(plan)]]
+
+    with _locked():
+        # Failed entries go back in front of whatever was deferred during the flush
+        _write(journal_path(), remaining + _read(journal_path()))
+        _write(_flushing_path(), [])
+        _write(_progress_path(), [])
+    console.print(f"Flushed {len(entries)} journal entries as {writes} writes: "
+                  f"{len(plans) - len(failed)} flags succeeded, {len(failed)} failed.")
+    for plan in failed:
+        console.print(f"[red]✗ {plan.key}[/red] (kept in the journal)")
+    return not failed
@@ -0,0 +1,162 @@
+import csv
+import json
+import os
+import sys
+import threading
+from ph.utils import trace
+
+FORMATS = ['table', 'json', 'ndjson', 'csv']
+
+# Default for commands without an explicit -f: table on a terminal, ndjson in pipes
+PH_OUTPUT = os.environ.get('PH_OUTPUT', 'auto')
+
+_console = None
+_log_console = None
+_settings = threading.local()
+_orjson = None
+
+def set_output_format(output_format):
+    """Format picked with `ph --output`, for the commands of the current thread."""
+    _settings.output_format = output_format
+
+def resolve_format(output_format=None):
+    output_format = output_format or getattr(_settings, 'output_format', None) or PH_OUTPUT
+    if output_format == 'auto':
+        return 'table' if sys.stdout.isatty() else 'ndjson'
+    return output_format
+
+def _get_orjson():
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+def dumps(data, indent=False):
+    """JSON text, with orjson when it is installed (`pip install 'ph[fast]'`)."""
+    orjson = _get_orjson()
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0).decode('utf-8')
+    return json.dumps(data, indent=2 if indent else None, separators=None if indent else (',', ':'))
+
+def loads(data):
+    """Parse JSON text or bytes, with orjson when it is installed."""
+    orjson = _get_orjson()
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def get_console():
+    """The rich console shared by logging, progress bars and pretty output."""
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+def get_log_console():
+    """Console for log records: stdout on a terminal, stderr when stdout is piped so it only carries data."""
+    global _log_console
+    if sys.stdout.isatty():
+        return get_console()
+    if _log_console is None:
+        from rich.console import Console
+        _log_console = Console(stderr=True)
+    return _log_console
+
+class Writer:
+    """Writes rows (lists of values in `fields` order) to a stream as they arrive."""
+
+    def __init__(self, fields, stream=None):
+        self.fields = fields
+        self.stream = stream or sys.stdout
+
+    def write_rows(self, rows):
+        with trace.span("render", rows=len(rows)):
+            self._write_rows(rows)
+            self.stream.flush()
+
+    def _write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class TableWriter(Writer):
+    """Write rows as aligned columns. Widths come from the first batch so rows can be streamed."""
+
+    MAX_WIDTH = 40
+
+    def __init__(self, fields, stream=None):
+        super().__init__(fields, stream)
+        self.widths = None
+
+    def _cell(self, value, width):
+        text = "" if value is None else str(value)
+        if len(text) > width:
+            text = text[:width - 1] + "…"
+        return text.ljust(width)
+
+    def _line(self, values):
+        cells = [self._cell(value, width) for value, width in zip(values, self.widths)]
+        return "  ".join(cells).rstrip() + "\n"
+
+    def _write_rows(self, rows):
+        if self.widths is None:
+            self.widths = [len(field) for field in self.fields]
+            for row in rows:
+                for i, value in enumerate(row):
+                    size = len("" if value is None else str(value))
+                    self.widths[i] = min(max(self.widths[i], size), self.MAX_WIDTH)
+            self.stream.write(self._line(self.fields))
+        self.stream.write("".join(self._line(row) for row in rows))
+
+class NdjsonWriter(Writer):
+    def _write_rows(self, rows):
+        self.stream.write("".join(dumps(dict(zip(self.fields, row))) + "\n" for row in rows))
+
+class JsonWriter(Writer):
+    """One JSON array, streamed element by element. close() writes the closing bracket."""
+
+    def __init__(self, fields, stream=None):
+        super().__init__(fields, stream)
+        self.started = False
+
+    def _write_rows(self, rows):
+        for row in rows:
+            self.stream.write(("," if self.started else "[") + "\n" + dumps(dict(zip(self.fields, row))))
+            self.started = True
+
+    def close(self):
+        self.stream.write(("\n]" if self.started else "[]") + "\n")
+        self.stream.flush()
+
+class CsvWriter(Writer):
+    def __init__(self, fields, stream=None):
+        super().__init__(fields, stream)
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(fields)
+
+    def _write_rows(self, rows):
+        self.writer.writerows(
+            [dumps(value) if isinstance(value, (dict, list)) else value for value in row]
+            for row in rows)
+
+def get_writer(output_format, fields, stream=None):
+    """Writer for output_format, or for the `ph --output` / PH_OUTPUT default when it is None."""
+    writers = {'table': TableWriter, 'json': JsonWriter, 'ndjson': NdjsonWriter, 'csv': CsvWriter}
+    return writers[resolve_format(output_format)](fields, stream)
+
+def print_document(data, output_format=None):
+    """Print one JSON document. Highlighted by rich on a terminal, written straight to stdout otherwise."""
+    output_format = resolve_format(output_format)
+    with trace.span("render"):
+        if output_format == 'table' and sys.stdout.isatty():
+            get_console().print(json.dumps(data, indent=4))
+        elif output_format == 'csv':
+            writer = CsvWriter(list(data))
+            writer.write_rows([list(data.values())])
+        else:
+            sys.stdout.write(dumps(data, indent=output_format != 'ndjson') + "\n")
+            sys.stdout.flush()
@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ph.utils import client
+from ph.utils.auth import get_url
+from ph.utils.client import log_error
+from ph.utils.credentials import get_credentials
+from ph.utils.workers import PH_PARALLELISM
+
+logger = logging.getLogger('ph')
+
+def fetch_projects(headers, organization=None):
+    """All projects of the organization, following the `next` cursor."""
+    organization = organization or get_credentials().organization
+    if not organization:
+        logger.error("No organization selected, run `ph organization` first.")
+        return None
+    url = get_url(f'api/organizations/{organization}/projects')
+    projects = []
+    while url:
+        response = client.get(url, headers=headers)
+        if response.status_code != 200:
+            log_error(response)
+            return None
+        data = response.json()
+        projects.extend(data.get('results') or [])
+        url = data.get('next')
+    return projects
+
+def select_projects(headers, names=(), all_projects=False):
+    """Resolve --projects ids/names (or --all-projects) to project dicts with `id` and `name`."""
+    projects = fetch_projects(headers)
+    if projects is None:
+        return None
+    if all_projects:
+        return projects
+
+    by_id = {str(project['id']): project for project in projects}
+    by_name = {project['name']: project for project in projects}
+    selected = []
+    for name in names:
+        project = by_id.get(name) or by_name.get(name)
+        if project is None:
+            logger.error(f"Project not found: {name}")
+            return None
+        if project not in selected:
+            selected.append(project)
+    return selected
+
+def stream_projects(projects, iter_pages, parallel=None):
+    """Run iter_pages(project) for every project on a bounded thread pool.
+
+    Yields (project, page, error) as soon as any project produces a page, so results of fast
+    projects are not held back by slow ones."""
+    results = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def worker(project):
+        try:
+            if stop.is_set():
+                return
+            for page in iter_pages(project):
+                if stop.is_set():
+                    break
+                results.put((project, page, None))
+        except Exception as e:
+            logger.debug(f"Project {project['id']} failed: {e!r}")
+            results.put((project, None, e))
+        finally:
+            results.put((project, done, None))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel or PH_PARALLELISM, len(projects)))) as executor:
+        for project in projects:
+            executor.submit(worker, project)
+        remaining = len(projects)
+        try:
+            while remaining:
+                project, page, error = results.get()
+                if page is done:
+                    remaining -= 1
+                    continue
+                yield project, page, error
+        finally:
+            stop.set()
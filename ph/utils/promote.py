@@ -0,0 +1,120 @@
+"""Compare the flags of two projects (e.g. staging and production) and copy the differences.
+
+Both flag lists are fetched concurrently. Each flag is reduced to a fingerprint of its normalized
+managed fields, so comparing thousands of flags is one dict lookup per key. Promotion goes through
+the same plan as `ph flags apply`: creates and version-checked PATCHes of only the changed fields.
+"""
+import fnmatch
+import hashlib
+import json
+import logging
+from ph.utils import flag_index
+from ph.utils.apply import MANAGED_FIELDS, changed_fields, execute_plan, normalize, plan_changes, print_plan
+from ph.utils.auth import get_headers
+from ph.utils.flags import iter_flags
+from ph.utils.output import get_console, get_writer
+from ph.utils.projects import select_projects
+from ph.utils.workers import run_parallel
+
+logger = logging.getLogger('ph')
+
+DIFF_FIELDS = ['key', 'status', 'fields']
+
+def fingerprint(flag):
+    """Hash of the normalized managed fields: equal fingerprints mean nothing to promote."""
+    fields = normalize({field: flag.get(field) for field in MANAGED_FIELDS})
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def resolve_projects(headers, source, target):
+    projects = select_projects(headers, [source, target])
+    if projects is None:
+        return None, None
+    if len(projects) < 2:
+        logger.error("--from and --to are the same project.")
+        return None, None
+    return projects
+
+def fetch_flags(projects, headers, parallel=None):
+    """{project id: {key: flag}} for every project, fetched concurrently. None when one failed."""
+    flags = {}
+
+    def fetch(project):
+        return {flag['key']: flag for flag in iter_flags(project['id'], headers)}
+    for project, result, error in run_parallel(projects, fetch, parallel):
+        if error:
+            logger.error(f"Could not fetch the flags of {project['name']}: {error}")
+            return None
+        flag_index.remember_flags(project['id'], result.values())
+        flags[project['id']] = result
+    return flags
+
+def compare(source, target):
+    """(key, status, changed fields) for every key whose flags differ, sorted by key.
+    status is `added` (only in source), `removed` (only in target) or `changed`."""
+    differences = []
+    for key in sorted(source.keys() | target.keys()):
+        if key not in target:
+            differences.append((key, 'added', []))
+        elif key not in source:
+            differences.append((key, 'removed', []))
+        elif fingerprint(source[key]) != fingerprint(target[key]):
+            fields = {field: source[key].get(field) for field in MANAGED_FIELDS}
+            differences.append((key, 'changed', sorted(changed_fields(target[key], fields))))
+    return differences
+
+def _load(source_name, target_name, parallel):
+    headers = get_headers()
+    source, target = resolve_projects(headers, source_name, target_name)
+    if source is None:
+        return None
+    flags = fetch_flags([source, target], headers, parallel)
+    if flags is None:
+        return None
+    return headers, source, target, flags[source['id']], flags[target['id']]
+
+def diff_flags(source_name, target_name, output_format=None, parallel=None):
+    """Print the flags that differ between two projects.
+    Returns True when they match, False when they differ and None when they could not be compared."""
+    loaded = _load(source_name, target_name, parallel)
+    if loaded is None:
+        return None
+    _, source, target, source_flags, target_flags = loaded
+    differences = compare(source_flags, target_flags)
+    if differences:
+        writer = get_writer(output_format, DIFF_FIELDS)
+        writer.write_rows([[key, status, ",".join(fields)] for key, status, fields in differences])
+        writer.close()
+    counts = {status: sum(1 for _, s, _ in differences if s == status) for status in ('added', 'removed', 'changed')}
+    logger.info(f"{source['name']} -> {target['name']}: {counts['added']} only in {source['name']}, "
+                f"{counts['removed']} only in {target['name']}, {counts['changed']} changed, "
+                f"{len(source_flags.keys() & target_flags.keys()) - counts['changed']} identical.")
+    return not differences
+
+def promote_flags(source_name, target_name, keys=(), patterns=(), all_flags=False, dry_run=False, parallel=None):
+    """Copy the selected flags (or every added/changed one) from one project to another."""
+    loaded = _load(source_name, target_name, parallel)
+    if loaded is None:
+        return False
+    headers, source, target, source_flags, target_flags = loaded
+
+    missing = [key for key in keys if key not in source_flags]
+    for key in missing:
+        logger.error(f"Flag not found in {source['name']}: {key}")
+    if missing:
+        return False
+    selected = {key: flag for key, flag in sorted(source_flags.items())
+                if all_flags or key in keys or any(fnmatch.fnmatchcase(key, pattern) for pattern in patterns)}
+    # Identical flags are skipped by fingerprint before any field comparison
+    desired = {key: flag for key, flag in selected.items()
+               if key not in target_flags or fingerprint(flag) != fingerprint(target_flags[key])}
+
+    plan = plan_changes(desired, target_flags)
+    get_console().print(f"{source['name']} -> {target['name']}")
+    print_plan(plan)
+    if dry_run or not plan:
+        return True
+    failed = execute_plan(plan, target['id'], headers, parallel)
+    get_console().print(f"Promoted {len(plan) - len(failed)}/{len(plan)} flags.")
+    if failed:
+        logger.error(f"Failed: {', '.join(sorted(failed))}")
+    return not failed
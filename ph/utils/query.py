@@ -0,0 +1,344 @@
+"""HogQL queries: streamed to a writer, paged when they are ordered, and cached locally.
+
+Separate runs of a query only return rows in the same order when the query has an ORDER BY, so only
+a query with a top-level ORDER BY (on columns that make rows unique) is paged: `<query> LIMIT n
+OFFSET m`, with pages requested a few ahead of the one being written and written in order. Each page
+runs the query again. Any other query is fetched in one request of up to MAX_PAGE_SIZE rows.
+
+Every result is also written to a gzipped cache file while it streams; a repeat of the same query,
+project and time range within PH_QUERY_CACHE_TTL is then read back from disk.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ph.utils import client
+from ph.utils.auth import get_headers, get_url
+from ph.utils.client import APIError, log_error
+from ph.utils.credentials import POSTHOG_DIR, PH_ENDPOINT, get_credentials
+from ph.utils.output import dumps, get_writer, loads
+
+logger = logging.getLogger('ph')
+
+CACHE_DIR = os.path.join(POSTHOG_DIR, 'query_cache')
+PH_QUERY_CACHE_TTL = int(os.environ.get('PH_QUERY_CACHE_TTL', '300'))
+PH_QUERY_CACHE_MAX_MB = int(os.environ.get('PH_QUERY_CACHE_MAX_MB', '256'))
+# Largest LIMIT HogQL accepts
+MAX_PAGE_SIZE = 50000
+FILE_FORMATS = {'.csv': 'csv', '.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson',
+                '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+def cache_key(query, project_id, date_from=None, date_to=None):
+    text = "\n".join([PH_ENDPOINT, str(project_id), " ".join(query.split()), date_from or "", date_to or ""])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.ndjson.gz")
+
+def read_cache(key, ttl=PH_QUERY_CACHE_TTL):
+    """(columns, types, iterator of row pages) of a fresh cache entry, or None."""
+    path = _cache_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        file = gzip.open(path, 'rb')
+        header = loads(file.readline())
+    except (OSError, ValueError):
+        return None
+
+    def pages(size=1000):
+        with file:
+            page = []
+            for line in file:
+                page.append(loads(line))
+                if len(page) >= size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+    # Reading counts as a use for the eviction order, the header keeps the creation time for the TTL
+    os.utime(path, (time.time(), header.get('created_at', time.time())))
+    return header['columns'], header['types'], pages()
+
+class CacheWriter:
+    """Writes a result to a temp file while it streams, renamed into the cache once it is complete.
+    Results bigger than the cache itself are dropped instead of evicting everything else."""
+
+    def __init__(self, key, columns, types):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.key = key
+        fd, self.tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        self.raw = os.fdopen(fd, 'wb')
+        self.file = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=5)
+        self.file.write(dumps({"columns": columns, "types": types, "created_at": time.time()}).encode('utf-8') + b'\n')
+
+    def write_rows(self, rows):
+        if self.file is None:
+            return
+        self.file.write(b''.join(dumps(row).encode('utf-8') + b'\n' for row in rows))
+        if self.raw.tell() > PH_QUERY_CACHE_MAX_MB * 1024 * 1024:
+            self.discard()
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.raw.close()
+            os.remove(self.tmp_path)
+            self.file = None
+
+    def commit(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.raw.close()
+        os.replace(self.tmp_path, _cache_path(self.key))
+        self.file = None
+        evict_cache()
+
+def evict_cache(max_bytes=None, ttl=PH_QUERY_CACHE_TTL):
+    """Remove expired entries, then the least recently used ones until the cache fits in max_bytes."""
+    max_bytes = PH_QUERY_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    now = time.time()
+    entries = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        # mtime is the creation time, atime the last use (see read_cache)
+        if name.endswith('.ndjson.gz') and now - stat.st_mtime > ttl:
+            os.remove(path)
+        elif name.endswith('.ndjson.gz'):
+            entries.append((stat.st_atime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+def _type_name(value):
+    # Types come as [name, type] pairs or as plain type names
+    return value[1] if isinstance(value, (list, tuple)) else value
+
+# Strings, quoted names and comments (skipped), parentheses and words
+TOKENS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|--[^\n]*|/\*.*?\*/|[()]|[A-Za-z_]\w*", re.S)
+
+def top_level_words(query):
+    """Upper-cased keywords and names of the outer SELECT: not in parentheses, strings or comments."""
+    words = []
+    depth = 0
+    for match in TOKENS.finditer(query):
+        token = match.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0 and (token[0].isalpha() or token[0] == '_'):
+            words.append(token.upper())
+    return words
+
+def is_pageable(query):
+    """True for a single SELECT with its own ORDER BY and no LIMIT: pages of it line up."""
+    words = top_level_words(query)
+    return ('ORDER', 'BY') in set(zip(words, words[1:])) and 'LIMIT' not in words and 'UNION' not in words
+
+def has_limit(query):
+    return 'LIMIT' in top_level_words(query)
+
+def fetch_page(project_id, headers, sql, date_from=None, date_to=None):
+    """The rows of one query request as (columns, types, rows)."""
+    body = {"kind": "HogQLQuery", "query": sql}
+    if date_from or date_to:
+        body["filters"] = {"dateRange": {"date_from": date_from, "date_to": date_to}}
+    # Running a query changes nothing, so it is safe to retry
+    response = client.post(get_url(f'api/projects/{project_id}/query/'), headers=headers, idempotent=True,
+                           json={"query": body})
+    if response.status_code != 200:
+        try:
+            detail = response.json().get('detail')
+        except ValueError:
+            detail = None
+        if detail:
+            logger.error(f"Query failed: {detail}")
+        else:
+            log_error(response)
+        raise APIError(response)
+    data = response.json()
+    return data.get('columns') or [], [_type_name(value) for value in data.get('types') or []], data.get('results') or []
+
+def iter_pages(project_id, headers, query, page_size, limit=None, date_from=None, date_to=None, ahead=2):
+    """Yield (columns, types, rows) pages of an ordered query, with up to `ahead` pages requested at
+    once. A page shorter than page_size is the last one."""
+    page_size = min(page_size, limit) if limit else page_size
+    with ThreadPoolExecutor(max_workers=max(1, ahead)) as executor:
+        pending = deque()
+        offset = 0
+        done = False
+        try:
+            while not done or pending:
+                while not done and len(pending) < max(1, ahead):
+                    size = min(page_size, limit - offset) if limit else page_size
+                    # On its own line, so a trailing comment in the query does not swallow it
+                    sql = f"{query}\nLIMIT {size} OFFSET {offset}"
+                    pending.append((size, executor.submit(fetch_page, project_id, headers, sql, date_from, date_to)))
+                    offset += size
+                    done = bool(limit) and offset >= limit
+                size, future = pending.popleft()
+                columns, types, rows = future.result()
+                if len(rows) < size:
+                    done = True
+                    for _, other in pending:
+                        other.cancel()
+                    pending.clear()
+                yield columns, types, rows
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def iter_results(project_id, headers, query, page_size, limit=None, date_from=None, date_to=None, ahead=2):
+    """Yield (columns, types, rows) pages: paged when the query is ordered, else one request."""
+    query = query.strip().rstrip(';')
+    if is_pageable(query):
+        yield from iter_pages(project_id, headers, query, page_size, limit, date_from, date_to, ahead)
+        return
+    if has_limit(query):
+        yield fetch_page(project_id, headers, query, date_from, date_to)
+        return
+    size = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    columns, types, rows = fetch_page(project_id, headers, f"SELECT * FROM ({query}\n) LIMIT {size}", date_from, date_to)
+    if len(rows) >= size and (not limit or limit > size):
+        logger.warning(f"Only the first {size:,} rows: add an ORDER BY on columns that make rows unique "
+                       f"to page through the whole result.")
+    yield columns, types, rows
+
+def arrow_type(type_name):
+    import pyarrow
+    name = type_name or ''
+    while name.startswith(('Nullable(', 'LowCardinality(')):
+        name = name[name.index('(') + 1:-1]
+    if name.startswith(('Int', 'UInt')):
+        return pyarrow.int64()
+    if name.startswith(('Float', 'Decimal')):
+        return pyarrow.float64()
+    if name in ('Bool', 'Boolean'):
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+class ArrowWriter:
+    """Writes row pages to Parquet or Arrow IPC as one record batch each. Types come from the HogQL
+    column types; anything that is not a number or a bool is written as a string (JSON for arrays
+    and maps)."""
+
+    def __init__(self, path, output_format, columns, types):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ValueError("pyarrow is required for Parquet and Arrow files: pip install 'ph[parquet]'")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(column, arrow_type(types[i] if i < len(types) else None))
+                                      for i, column in enumerate(columns)])
+        if output_format == 'parquet':
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def _value(self, value, field):
+        if value is None or not self.pyarrow.types.is_string(field.type):
+            return value
+        return value if isinstance(value, str) else dumps(value)
+
+    def write_rows(self, rows):
+        arrays = [self.pyarrow.array([self._value(row[i], field) for row in rows], type=field.type)
+                  for i, field in enumerate(self.schema)]
+        self.writer.write_batch(self.pyarrow.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def output_format_for(path, output_format=None):
+    if output_format or not path:
+        return output_format
+    return FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+
+def run_query(query, output_format=None, path=None, page_size=10000, limit=None, date_from=None, date_to=None,
+              ahead=2, use_cache=True):
+    """Run a HogQL query on the current project and stream its rows to stdout or a file."""
+    project_id = get_credentials().project
+    output_format = output_format_for(path, output_format)
+    if output_format in ('parquet', 'arrow') and not path:
+        logger.error(f"{output_format} output needs a file: pass -o results.{output_format}")
+        return False
+    if limit and has_limit(query.strip().rstrip(';')):
+        logger.error("The query has its own LIMIT: drop it or --limit.")
+        return False
+    key = cache_key(query, project_id, date_from, date_to) + (f"-{limit}" if limit else "")
+    cached = read_cache(key) if use_cache else None
+
+    if cached:
+        logger.debug(f"Query result from the cache: {key}")
+        columns, types, pages = cached
+        cache = None
+    else:
+        headers = get_headers()
+        fetched = iter_results(project_id, headers, query, page_size, limit, date_from, date_to, ahead)
+        try:
+            columns, types, first = next(fetched)
+        except APIError:
+            return False
+        except StopIteration:
+            columns, types, first = [], [], []
+
+        def chain_pages():
+            yield first
+            for _, _, rows in fetched:
+                yield rows
+        pages = chain_pages()
+        cache = CacheWriter(key, columns, types) if use_cache else None
+
+    stream = None
+    try:
+        if output_format in ('parquet', 'arrow'):
+            writer = ArrowWriter(path, output_format, columns, types)
+        else:
+            stream = open(path, 'w', newline='') if path else None
+            writer = get_writer(output_format, columns, stream or sys.stdout)
+        total = 0
+        try:
+            for rows in pages:
+                if not rows:
+                    continue
+                writer.write_rows(rows)
+                if cache:
+                    cache.write_rows(rows)
+                total += len(rows)
+        except APIError:
+            return False
+        finally:
+            writer.close()
+        if cache:
+            cache.commit()
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    finally:
+        if cache:
+            cache.discard()
+        if stream:
+            stream.close()
+    if path:
+        logger.info(f"{total:,} rows written to {path}{' (cached)' if cached else ''}")
+    return True
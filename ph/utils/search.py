@@ -0,0 +1,213 @@
+import heapq
+import logging
+import os
+import time
+from bisect import bisect_right
+from ph.utils import trace
+
+logger = logging.getLogger('ph')
+
+# A snapshot older than this is brought up to date (an incremental sync) before searching it
+PH_SEARCH_CACHE_TTL = int(os.environ.get('PH_SEARCH_CACHE_TTL', '300'))
+
+def _subsequence_gaps(query, text):
+    """Characters skipped to find query as a subsequence of text, or None if it is not one."""
+    position = 0
+    gaps = 0
+    for char in query:
+        found = text.find(char, position)
+        if found < 0:
+            return None
+        gaps += found - position
+        position = found + 1
+    return gaps
+
+class SearchIndex:
+    """In-memory index over the key, name and tags of flags.
+
+    The searchable text of every flag is joined into one string with an offset table, so substring
+    matches come from str.find scans instead of a loop over flags. Results are ranked: exact key,
+    key prefix, key substring, name/tag substring, and last fuzzy (subsequence) matches on the key.
+    Typing more characters only looks at the matches of the previous query."""
+
+    def __init__(self, flags):
+        with trace.span("search index build"):
+            self.flags = list(flags)
+            self.keys = [(flag.get('key') or '').lower() for flag in self.flags]
+            self.texts = [
+                ' '.join([key, (flag.get('name') or '').lower()] + [str(tag).lower() for tag in flag.get('tags') or []])
+                for key, flag in zip(self.keys, self.flags)]
+            self.haystack = '\n'.join(self.texts)
+            self.starts = []
+            offset = 0
+            for text in self.texts:
+                self.starts.append(offset)
+                offset += len(text) + 1
+        self._last = None
+
+    def _substring_matches(self, query):
+        if self._last and query.startswith(self._last[0]):
+            return [i for i in self._last[1] if query in self.texts[i]]
+        matches = []
+        haystack, starts = self.haystack, self.starts
+        position = haystack.find(query)
+        while position >= 0:
+            i = bisect_right(starts, position) - 1
+            matches.append(i)
+            if i + 1 >= len(starts):
+                break
+            position = haystack.find(query, starts[i + 1])
+        return matches
+
+    def _fuzzy_candidates(self, query):
+        if self._last and self._last[2] is not None and query.startswith(self._last[0]):
+            return self._last[2]
+        return range(len(self.flags))
+
+    def _score(self, i, query):
+        key = self.keys[i]
+        if key == query:
+            return (0, 0, len(key))
+        position = key.find(query)
+        if position == 0:
+            return (1, 0, len(key))
+        if position > 0:
+            return (2, position, len(key))
+        return (3, self.texts[i].find(query), len(key))
+
+    def search(self, query, limit=None):
+        """Flags matching query, best first."""
+        query = query.strip().lower()
+        if not query:
+            self._last = None
+            return self.flags[:limit] if limit else list(self.flags)
+
+        substring = self._substring_matches(query)
+        scored = [(self._score(i, query), i) for i in substring]
+        fuzzy = None
+        # Fuzzy matches rank last, so they are only needed when there are not enough substring matches
+        if limit is None or len(substring) < limit:
+            matched = set(substring)
+            fuzzy = []
+            for i in self._fuzzy_candidates(query):
+                if i not in matched:
+                    gaps = _subsequence_gaps(query, self.keys[i])
+                    if gaps is not None:
+                        fuzzy.append(i)
+                        scored.append(((4, gaps, len(self.keys[i])), i))
+            fuzzy.extend(substring)
+        # Longer queries only match a subset of these, so the next keystroke starts from here
+        self._last = (query, substring, fuzzy)
+        best = heapq.nsmallest(limit, scored) if limit else sorted(scored)
+        return [self.flags[i] for _, i in best]
+
+def cached_flags(project_id, headers):
+    """Flags of the local snapshot, synced first when it is older than PH_SEARCH_CACHE_TTL. None if there is none."""
+    from ph.utils import snapshot
+    path = snapshot.snapshot_path(project_id)
+    if not os.path.exists(path):
+        return None
+    if time.time() - snapshot.load_meta(path).get('synced_at', 0) > PH_SEARCH_CACHE_TTL:
+        snapshot.sync_snapshot(project_id, headers, path)
+    return list(snapshot.read_snapshot(path))
+
+def search_flags(query, limit=20, fields=None, output_format=None):
+    """Search flags by key, name and tags in the cached flag list, or with the API when there is none."""
+    from ph.utils.auth import get_headers
+    from ph.utils.client import APIError
+    from ph.utils.credentials import get_credentials
+    from ph.utils.flags import DEFAULT_FIELDS, flag_field, iter_flags
+    from ph.utils.output import get_writer
+    headers = get_headers()
+    project_id = get_credentials().project
+    fields = fields or DEFAULT_FIELDS
+    try:
+        flags = cached_flags(project_id, headers)
+        if flags is not None:
+            results = SearchIndex(flags).search(query, limit)
+        else:
+            logger.debug("No local snapshot, searching with the API")
+            results = []
+            for flag in iter_flags(project_id, headers, params={"search": query}):
+                results.append(flag)
+                if limit and len(results) >= limit:
+                    break
+    except APIError:
+        return False
+
+    if not results:
+        logger.info("No flags found.")
+        return True
+    writer = get_writer(output_format, fields)
+    writer.write_rows([[flag_field(flag, field) for field in fields] for flag in results])
+    writer.close()
+    return True
+
+def pick_flag(index, query='', height=15):
+    """Incremental filter in the terminal: results are re-ranked locally on every keystroke.
+
+    Returns the selected flag, or None when cancelled."""
+    from blessed import Terminal
+    term = Terminal()
+    selected = 0
+    results = index.search(query, height)
+    drawn = 0
+    with term.cbreak():
+        while True:
+            lines = [term.bold("Search: ") + query + term.dim(f"  ({len(index.flags)} flags, ↑/↓ to move, enter to pick, esc to cancel)")]
+            for i, flag in enumerate(results):
+                line = f"{flag.get('key')}  {term.dim(flag.get('name') or '')}"
+                lines.append(term.reverse(line) if i == selected else line)
+            # Move back to the first line drawn last time and redraw everything below it
+            output = term.move_up(drawn - 1) if drawn > 1 else ''
+            output += '\r' + term.clear_eos + '\n'.join(lines)
+            print(output, end='', flush=True)
+            drawn = len(lines)
+
+            key = term.inkey()
+            if key.code == term.KEY_ENTER:
+                break
+            if key.code == term.KEY_ESCAPE or key == '\x03':
+                results = []
+                break
+            if key.code == term.KEY_UP:
+                selected = max(selected - 1, 0)
+                continue
+            if key.code == term.KEY_DOWN:
+                selected = min(selected + 1, max(len(results) - 1, 0))
+                continue
+            if key.code in (term.KEY_BACKSPACE, term.KEY_DELETE):
+                query = query[:-1]
+            elif key and not key.is_sequence and key.isprintable():
+                query += key
+            else:
+                continue
+            results = index.search(query, height)
+            selected = 0
+    print()
+    return results[selected] if results else None
+
+def interactive_search(query=''):
+    """Pick a flag with the incremental filter and print it."""
+    from ph.utils import snapshot
+    from ph.utils.auth import get_headers
+    from ph.utils.client import APIError
+    from ph.utils.credentials import get_credentials
+    from ph.utils.output import print_document
+    headers = get_headers()
+    project_id = get_credentials().project
+    try:
+        flags = cached_flags(project_id, headers)
+        if flags is None:
+            # One full download, kept as the snapshot so the next search starts warm
+            snapshot.sync_snapshot(project_id, headers)
+            flags = list(snapshot.read_snapshot(snapshot.snapshot_path(project_id)))
+    except APIError:
+        return False
+    if not flags:
+        logger.info("No flags found.")
+        return True
+    flag = pick_flag(SearchIndex(flags), query)
+    if flag:
+        print_document(flag)
+    return True
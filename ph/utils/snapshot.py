@@ -0,0 +1,153 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from ph.utils.credentials import POSTHOG_DIR, PH_ENDPOINT, write_json_atomic
+
+logger = logging.getLogger('ph')
+
+SNAPSHOT_DIR = os.path.join(POSTHOG_DIR, 'snapshots')
+
+def snapshot_path(project_id):
+    return os.path.join(SNAPSHOT_DIR, f"{PH_ENDPOINT}_{project_id}.ndjson.gz")
+
+def _meta_path(path):
+    return path + '.meta.json'
+
+def _open(path, mode):
+    return gzip.open(path, mode + 't', encoding='utf-8') if path.endswith('.gz') else open(path, mode, encoding='utf-8')
+
+def load_meta(path):
+    try:
+        with open(_meta_path(path), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def read_snapshot(path):
+    """Yield the flags of a snapshot file, one at a time."""
+    try:
+        with _open(path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+def has_snapshot(project_id):
+    return os.path.exists(snapshot_path(project_id))
+
+def find_flag(project_id, key):
+    for flag in read_snapshot(snapshot_path(project_id)):
+        if flag.get('key') == key:
+            return flag
+    return None
+
+def write_snapshot(path, flags, watermark):
+    """Write flags (sorted by key) to a temp file and rename it into place, then the watermark."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        compressed = path.endswith('.gz')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') if compressed else open(tmp_path, 'w', encoding='utf-8') as file:
+            for flag in sorted(flags, key=lambda flag: flag['key']):
+                file.write(json.dumps(flag, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    write_json_atomic(_meta_path(path), {
+        "endpoint": PH_ENDPOINT,
+        "watermark": watermark,
+        "count": len(flags),
+        "synced_at": time.time(),
+    })
+
+def _watermark(flags, default=None):
+    return max((flag.get('updated_at') or '' for flag in flags), default=default) or default
+
+def fetch_changed(project_id, headers, watermark, etag=None):
+    """Flags updated after the watermark, newest first, plus the current flag count and the ETag of
+    the first page. Pages are only read until the watermark is reached.
+
+    Returns (changed, count, etag). changed is None if the server ignored the ordering, and empty
+    with a None count when the server answered 304 to `etag`."""
+    from ph.utils import client
+    from ph.utils.auth import get_url
+    from ph.utils.client import APIError, log_error
+    from ph.utils.flags import PAGE_SIZE
+    url = get_url(f'api/projects/{project_id}/feature_flags')
+    params = {"limit": PAGE_SIZE, "order": "-updated_at"}
+    request_headers = dict(headers, **{'If-None-Match': etag}) if etag else headers
+    changed = []
+    count = None
+    previous = None
+    while url:
+        response = client.get(url, headers=request_headers, params=params)
+        if response.status_code == 304:
+            return [], None, etag
+        if response.status_code != 200:
+            log_error(response)
+            raise APIError(response)
+        data = response.json()
+        if count is None:
+            count = data.get('count')
+            etag = response.headers.get('ETag')
+        for flag in data.get('results') or []:
+            updated_at = flag.get('updated_at') or ''
+            if previous is not None and updated_at > previous:
+                return None, count, etag
+            previous = updated_at
+            if updated_at <= watermark:
+                return changed, count, etag
+            changed.append(flag)
+        url = data.get('next')
+        params = None
+        request_headers = headers
+    return changed, count, etag
+
+def sync_snapshot(project_id, headers, path=None, full=False):
+    """Bring a snapshot up to date. Only flags changed since the last watermark are downloaded,
+    with a full download when there is no snapshot yet or flags were deleted in the meantime."""
+    from ph.utils import flag_index
+    from ph.utils.flags import iter_flags
+    path = path or snapshot_path(project_id)
+    meta = load_meta(path)
+    watermark = None if full or not os.path.exists(path) else meta.get('watermark')
+
+    if watermark:
+        changed, count, _ = fetch_changed(project_id, headers, watermark)
+        if changed is not None:
+            flag_index.remember_flags(project_id, changed)
+            flags = {flag['id']: flag for flag in read_snapshot(path)}
+            for flag in changed:
+                flags[flag['id']] = flag
+            if count == len(flags):
+                write_snapshot(path, flags.values(), _watermark(changed, watermark))
+                return len(changed), len(flags)
+            logger.debug("Flag count changed, doing a full sync")
+        else:
+            logger.debug("Server ignored the updated_at ordering, doing a full sync")
+
+    flags = list(iter_flags(project_id, headers))
+    flag_index.remember_flags(project_id, flags)
+    write_snapshot(path, flags, _watermark(flags))
+    return len(flags), len(flags)
+
+def sync_flags(path=None, full=False):
+    """Sync the project's flags to a local snapshot (the default one, or `path`)."""
+    from ph.utils.auth import get_headers
+    from ph.utils.client import APIError
+    from ph.utils.credentials import get_credentials
+    project_id = get_credentials().project
+    try:
+        changed, total = sync_snapshot(project_id, get_headers(), path, full)
+    except APIError:
+        return False
+    logger.info(f"Synced {changed} changed flags, {total} in {path or snapshot_path(project_id)}")
+    return True
@@ -0,0 +1,133 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# PH_TRACE=1 prints a summary at exit, PH_TRACE=trace.json also writes a Chrome trace (chrome://tracing, Perfetto)
+PH_TRACE = os.environ.get('PH_TRACE', '')
+
+_spans = []
+_lock = threading.Lock()
+_enabled = False
+_trace_file = None
+_origin = time.perf_counter()
+
+def enable(trace_file=None):
+    global _enabled, _trace_file
+    if not _enabled:
+        atexit.register(report)
+        _patch_connections()
+    _enabled = True
+    _trace_file = trace_file or _trace_file
+
+def is_enabled():
+    return _enabled
+
+def record(name, category, start, end, **args):
+    """Record a finished span. start/end are time.perf_counter() values."""
+    if not _enabled:
+        return
+    with _lock:
+        _spans.append({
+            "name": name,
+            "cat": category,
+            "start": start,
+            "end": end,
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+@contextmanager
+def span(name, category='local', **args):
+    """Time a block. The yielded dict can be filled with extra fields while the block runs."""
+    if not _enabled:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        record(name, category, start, time.perf_counter(), **args)
+
+def _patch_connections():
+    """Record DNS+TCP and TLS setup as their own spans, inside the HTTP span that opened the connection."""
+    try:
+        import urllib3.connection
+        from urllib3.util import connection as util_connection
+    except ImportError:
+        return
+
+    create_connection = util_connection.create_connection
+
+    def traced_create_connection(address, *args, **kwargs):
+        with span("dns+tcp connect", "connect", host=f"{address[0]}:{address[1]}"):
+            return create_connection(address, *args, **kwargs)
+    util_connection.create_connection = traced_create_connection
+
+    https_connect = urllib3.connection.HTTPSConnection.connect
+
+    def traced_https_connect(self):
+        with span("connect (dns+tcp+tls)", "connect", host=self.host):
+            return https_connect(self)
+    urllib3.connection.HTTPSConnection.connect = traced_https_connect
+
+def chrome_trace():
+    pid = os.getpid()
+    events = []
+    for item in _spans:
+        events.append({
+            "name": item["name"],
+            "cat": item["cat"],
+            "ph": "X",
+            "ts": round((item["start"] - _origin) * 1e6, 1),
+            "dur": round((item["end"] - item["start"]) * 1e6, 1),
+            "pid": pid,
+            "tid": item["tid"],
+            "args": item["args"],
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def summary(stream=None):
+    """Write one line per HTTP call, then totals per span name."""
+    stream = stream or sys.stderr
+    with _lock:
+        spans = list(_spans)
+
+    http = [item for item in spans if item["cat"] == "http"]
+    if http:
+        stream.write(f"{'method':<6} {'status':>6} {'ms':>8} {'ttfb ms':>8} {'bytes':>9} {'retries':>7}  path\n")
+        for item in http:
+            args = item["args"]
+            stream.write(
+                f"{args.get('method', ''):<6} {str(args.get('status', '')):>6} "
+                f"{(item['end'] - item['start']) * 1000:>8.1f} {args.get('ttfb_ms', 0):>8.1f} "
+                f"{args.get('bytes', 0):>9} {args.get('retries', 0):>7}  {args.get('path', '')}\n")
+        stream.write("\n")
+
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for item in spans:
+        duration = (item["end"] - item["start"]) * 1000
+        total = totals[(item["cat"], item["name"] if item["cat"] != "http" else "http request")]
+        total[0] += 1
+        total[1] += duration
+        total[2] = max(total[2], duration)
+    stream.write(f"{'category':<9} {'span':<28} {'count':>6} {'total ms':>10} {'max ms':>9}\n")
+    for (category, name), (count, total_ms, max_ms) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        stream.write(f"{category:<9} {name:<28} {count:>6} {total_ms:>10.1f} {max_ms:>9.1f}\n")
+    stream.write(f"wall time {(time.perf_counter() - _origin) * 1000:.1f} ms\n")
+
+def report():
+    if not _spans:
+        return
+    summary()
+    if _trace_file:
+        with open(_trace_file, 'w') as file:
+            json.dump(chrome_trace(), file)
+        sys.stderr.write(f"Chrome trace written to {_trace_file}\n")
+
+if PH_TRACE and PH_TRACE.lower() not in ('0', 'false'):
+    enable(PH_TRACE if PH_TRACE.endswith('.json') else None)
@@ -0,0 +1,133 @@
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from ph.utils import flag_index
+from ph.utils.auth import get_headers
+from ph.utils.client import APIError
+from ph.utils.credentials import get_credentials
+from ph.utils.flags import flag_field, iter_flags
+from ph.utils.snapshot import fetch_changed
+
+logger = logging.getLogger('ph')
+
+# Bookkeeping fields that change on every save and are not worth reporting
+IGNORED_FIELDS = {'updated_at', 'version', 'last_modified_by', 'can_edit'}
+
+def diff_flag(before, after):
+    """Events describing how one flag changed. Either side may be None (added/removed)."""
+    if before is None:
+        return [{"event": "added", "key": after['key'], "id": after['id']}]
+    if after is None or after.get('deleted'):
+        return [{"event": "removed", "key": before['key'], "id": before['id']}]
+
+    events = []
+    base = {"key": after['key'], "id": after['id']}
+    if before.get('active') != after.get('active'):
+        events.append(dict(base, event="toggled", before=before.get('active'), after=after.get('active')))
+    before_rollout = flag_field(before, 'rollout_percentage')
+    after_rollout = flag_field(after, 'rollout_percentage')
+    if before_rollout != after_rollout:
+        events.append(dict(base, event="rollout_changed", before=before_rollout, after=after_rollout))
+
+    fields = sorted(field for field in set(before) | set(after)
+                    if field not in IGNORED_FIELDS and field != 'active' and before.get(field) != after.get(field))
+    # A rollout change shows up as a filters change too; only report filters when something else moved
+    if 'filters' in fields and before_rollout != after_rollout:
+        other_before = dict(before.get('filters') or {}, groups=None)
+        other_after = dict(after.get('filters') or {}, groups=None)
+        groups_before = [dict(group, rollout_percentage=None) for group in (before.get('filters') or {}).get('groups') or []]
+        groups_after = [dict(group, rollout_percentage=None) for group in (after.get('filters') or {}).get('groups') or []]
+        if other_before == other_after and groups_before == groups_after:
+            fields.remove('filters')
+    if fields:
+        events.append(dict(base, event="changed", fields=fields))
+    return events
+
+def format_event(event, output_format):
+    if output_format == 'ndjson':
+        return json.dumps(event)
+    text = f"{event['time']} {event['event']:<15} {event['key']}"
+    if 'before' in event:
+        text += f": {event['before']} -> {event['after']}"
+    elif 'fields' in event:
+        text += f": {', '.join(event['fields'])}"
+    return text
+
+class FlagWatcher:
+    """Keeps the flags of a project in memory and reports what changed since the last poll."""
+
+    def __init__(self, project_id, headers):
+        self.project_id = project_id
+        self.headers = headers
+        self.flags = {}
+        self.watermark = ''
+        self.etag = None
+
+    def _merge(self, flags, complete):
+        """Apply fetched flags to the state. `complete` means flags is the whole list, so the rest was removed."""
+        events = []
+        seen = set()
+        for flag in flags:
+            seen.add(flag['id'])
+            before = self.flags.get(flag['id'])
+            if flag.get('deleted'):
+                if before:
+                    events.extend(diff_flag(before, None))
+                    self.flags.pop(flag['id'])
+                continue
+            self.flags[flag['id']] = flag
+            events.extend(diff_flag(before, flag))
+            self.watermark = max(self.watermark, flag.get('updated_at') or '')
+        if complete:
+            for flag_id in [flag_id for flag_id in self.flags if flag_id not in seen]:
+                events.extend(diff_flag(self.flags.pop(flag_id), None))
+        flag_index.remember_flags(self.project_id, [flag for flag in flags if not flag.get('deleted')])
+        return events
+
+    def load(self):
+        self._merge(list(iter_flags(self.project_id, self.headers)), complete=True)
+
+    def poll(self):
+        """One conditional request in the common case. Returns the events since the last poll."""
+        changed, count, self.etag = fetch_changed(self.project_id, self.headers, self.watermark, self.etag)
+        if changed is not None:
+            events = self._merge(changed, complete=False)
+            if count is None or count == len(self.flags):
+                return events
+            logger.debug("Flag count changed, reloading every flag to find removed ones")
+        else:
+            events = []
+        return events + self._merge(list(iter_flags(self.project_id, self.headers)), complete=True)
+
+def watch_flags(interval=5, max_interval=60, output_format='text', stream=None):
+    """Poll for flag changes until interrupted, printing one line per change.
+
+    The interval doubles (up to max_interval) while nothing changes and drops back after a change."""
+    stream = stream or sys.stdout
+    watcher = FlagWatcher(get_credentials().project, get_headers())
+    try:
+        watcher.load()
+    except APIError:
+        return False
+    logger.info(f"Watching {len(watcher.flags)} flags, Ctrl+C to stop")
+
+    delay = interval
+    try:
+        while True:
+            time.sleep(delay)
+            try:
+                events = watcher.poll()
+            except APIError:
+                # Keep watching through outages, at the slowest pace
+                logger.warning(f"Polling failed, trying again in {max_interval}s")
+                delay = max_interval
+                continue
+            now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            for event in events:
+                stream.write(format_event(dict(time=now, **event), output_format) + "\n")
+            stream.flush()
+            delay = interval if events else min(delay * 2, max_interval)
+    except KeyboardInterrupt:
+        return True
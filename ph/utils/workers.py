@@ -0,0 +1,19 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger('ph')
+
+PH_PARALLELISM = int(os.environ.get('PH_PARALLELISM', '8'))
+
+def run_parallel(items, fn, parallel=None):
+    """Run fn(item) on a bounded thread pool. Yields (item, result, error) as each one finishes."""
+    with ThreadPoolExecutor(max_workers=max(1, parallel or PH_PARALLELISM)) as executor:
+        futures = {executor.submit(fn, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                logger.debug(f"Worker failed for {item}: {e!r}")
+                yield item, None, e
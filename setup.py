@@ -9,8 +9,15 @@ setup(
         'click==8.1.7',
         'rich==13.7.0',
         'requests==2.31.0',
-        'inquirer==3.2.4'
+        'inquirer==3.2.4',
+        # Terminal handling of the interactive flag picker (ph flags search)
+        'blessed>=1.19',
     ],
+    extras_require={
+        'yaml': ['PyYAML>=6.0'],
+        'fast': ['orjson>=3.9'],
+        'parquet': ['pyarrow>=14'],
+    },
     entry_points={
         'console_scripts': [
             'ph=ph.main:main',
@@ -0,0 +1,34 @@
+"""Point ph at an in-process stub server and a throwaway home directory.
+
+ph reads its endpoint and ~/.posthog paths when its modules are imported, so this runs before any
+test module imports ph.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from stub_server import TOKEN, start_server  # noqa: E402
+
+server, state = start_server(flags=20, projects=2)
+os.environ.update({
+    'HOME': tempfile.mkdtemp(prefix='ph-tests-'),
+    'PH_ENDPOINT': '127.0.0.1',
+    'PH_API_PROTOCOL_WEB': 'http',
+    'PH_API_PORT_WEB': str(server.server_port),
+    'PH_API_TOKEN': TOKEN,
+    'PH_HTTP_BACKOFF': '0',
+})
+
+@pytest.fixture
+def stub():
+    """The stub state, with project 1 selected in the credentials."""
+    from ph.utils.credentials import get_credentials
+    credentials = get_credentials()
+    if credentials.project != 1:
+        credentials.save(TOKEN, "1", 1)
+    state.reset_stats()
+    return state
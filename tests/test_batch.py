@@ -0,0 +1,13 @@
+import io
+import json
+
+from ph.utils.batch import parse_commands, run_batch
+
+def test_unparsable_line_fails_alone(stub):
+    lines = ['flags show flag-1', 'flags create "unterminated', 'flags show flag-2']
+    assert parse_commands(lines)[1].error
+    results = io.StringIO()
+    assert not run_batch(lines, results=results)
+    records = [json.loads(line) for line in results.getvalue().splitlines()]
+    assert [record["ok"] for record in records] == [True, False, True]
+    assert "No closing quotation" in records[1]["error"]
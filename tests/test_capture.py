@@ -0,0 +1,36 @@
+import json
+import threading
+
+from ph.utils.capture import Capture, capture_events, checkpoint_path
+from ph.utils.client import ConnectionFailed
+
+def write_events(path, count):
+    with open(path, 'w') as file:
+        for i in range(count):
+            file.write(json.dumps({"event": "test", "distinct_id": f"user-{i}", "properties": {"i": i}}) + "\n")
+
+def test_resume_does_not_send_batches_accepted_after_a_failed_one(stub, tmp_path, monkeypatch):
+    path = str(tmp_path / "events.ndjson")
+    write_events(path, 100)
+    send = Capture.send
+    later_sent = threading.Event()
+
+    def fail_second_batch(self, batch):
+        if b'"user-10"' in batch[0]:
+            # Fails only once the batches behind it were accepted
+            later_sent.wait(5)
+            raise ConnectionFailed('POST', 'batch/', 'connection reset')
+        result = send(self, batch)
+        if b'"user-30"' in batch[0]:
+            later_sent.set()
+        return result
+    monkeypatch.setattr(Capture, 'send', fail_second_batch)
+    assert not capture_events(path, api_key="phc_stub", batch_size=10, parallel=4)
+    sent_before = stub.stats["events"]
+    assert sent_before > 10
+    with open(checkpoint_path(path)) as file:
+        assert json.load(file)["offset"] > 0
+
+    monkeypatch.setattr(Capture, 'send', send)
+    assert capture_events(path, api_key="phc_stub", batch_size=10, parallel=4)
+    assert stub.stats["events"] == 100
@@ -0,0 +1,15 @@
+from ph.utils.evaluate import FlagEvaluator
+
+def flag(**filters):
+    return {"key": "f", "active": True, "filters": dict({"groups": [{"properties": [], "rollout_percentage": 50}]}, **filters)}
+
+def test_person_flags_are_bucketed_on_the_distinct_id():
+    evaluator = FlagEvaluator(flag())
+    assert {evaluator.evaluate(f"user-{n}") for n in range(100)} == {True, False}
+
+def test_group_flags_are_inconclusive():
+    evaluator = FlagEvaluator(flag(aggregation_group_type_index=0))
+    assert {evaluator.evaluate(f"user-{n}") for n in range(100)} == {None}
+
+def test_inactive_group_flags_are_false():
+    assert FlagEvaluator(dict(flag(aggregation_group_type_index=0), active=False)).evaluate("user-1") is False
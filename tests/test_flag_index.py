@@ -0,0 +1,44 @@
+import json
+import os
+import time
+
+from ph.utils import flag_index
+from ph.utils.credentials import write_json_atomic
+
+PROJECT = 'index-test'
+
+def write_disk(flags):
+    path = flag_index._index_file(PROJECT)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json_atomic(path, {"flags": flags}, durable=False)
+
+def read_disk():
+    with open(flag_index._index_file(PROJECT)) as file:
+        return json.load(file)["flags"]
+
+def entry(flag_id, fetched_at):
+    return {"id": flag_id, "version": 1, "updated_at": None, "etag": None, "fetched_at": fetched_at}
+
+def test_save_keeps_entries_of_other_processes():
+    flag_index._indexes.pop(PROJECT, None)
+    write_disk({"a": entry(1, time.time())})
+    flag_index.load_index(PROJECT)
+    # Another process saves "b" after this one loaded the index
+    write_disk({"a": entry(1, time.time()), "b": entry(2, time.time())})
+    flag_index.remember_flag(PROJECT, {"key": "c", "id": 3, "version": 1})
+    flag_index.flush()
+    assert {key: value["id"] for key, value in read_disk().items()} == {"a": 1, "b": 2, "c": 3}
+
+def test_removal_is_merged_unless_the_disk_entry_is_newer():
+    now = time.time()
+    index = {"a": entry(1, now - 10), "b": entry(2, now + 10)}
+    changes = {"a": (now, None), "b": (now, None)}
+    assert flag_index.merge_changes(index, changes) == {"b": entry(2, now + 10)}
+
+def test_most_recently_fetched_entry_wins():
+    now = time.time()
+    index = {"a": entry(1, now), "b": entry(2, now - 10)}
+    changes = {"a": (now, entry(10, now - 5)), "b": (now, entry(20, now))}
+    merged = flag_index.merge_changes(index, changes)
+    assert merged["a"]["id"] == 1
+    assert merged["b"]["id"] == 20
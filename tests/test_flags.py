@@ -0,0 +1,41 @@
+import requests
+
+from ph.utils import client
+from ph.utils.auth import get_headers
+from ph.utils.flags import get_flag, update_changes, update_flag, update_flag_fields
+
+def rollout(flag):
+    return flag["filters"]["groups"][0]["rollout_percentage"]
+
+def lose_first_patch_response(monkeypatch):
+    """The first PATCH reaches the server, but its response never comes back."""
+    session = client.get_session()
+    send = session.request
+    lost = []
+
+    def request(method, url, **kwargs):
+        response = send(method, url, **kwargs)
+        if method == 'PATCH' and not lost:
+            lost.append(response)
+            raise requests.ReadTimeout("read timed out")
+        return response
+    monkeypatch.setattr(session, 'request', request)
+    return lost
+
+def test_retry_of_an_applied_update_succeeds(stub, monkeypatch):
+    headers = get_headers()
+    version = get_flag(1, 'flag-3', headers)["version"]
+    lost = lose_first_patch_response(monkeypatch)
+    assert update_flag('flag-3', None, 42, project_id=1, headers=headers)
+    assert len(lost) == 1
+    flag = get_flag(1, 'flag-3', headers)
+    assert rollout(flag) == 42
+    assert flag["version"] == version + 1
+
+def test_conflict_with_another_change_fails(stub):
+    headers = get_headers()
+    flag = get_flag(1, 'flag-4', headers)
+    changes = update_changes(flag, None, 17)
+    assert update_flag('flag-4', "Renamed elsewhere", None, project_id=1, headers=headers)
+    assert not update_flag_fields('flag-4', changes, 1, headers, flag_id=flag["id"])
+    assert rollout(get_flag(1, 'flag-4', headers)) != 17
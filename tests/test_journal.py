@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from ph.utils import journal
+from ph.utils.journal import collapse, pending, record, replay_progress
+
+def entry(op, key='flag-1', at=0, **fields):
+    return dict({"op": op, "project": 1, "key": key, "at": at}, **fields)
+
+def steps(*entries):
+    plans = collapse(entries)
+    assert len(plans) == 1
+    return plans[0].steps()
+
+def test_disable_then_enable_is_one_change():
+    assert steps(entry('disable', at=1), entry('enable', at=2)) == [('update', {"active": True})]
+
+def test_create_then_delete_is_nothing():
+    assert steps(entry('create', at=1, description="x", rollout_percentage=10), entry('delete', at=2)) == []
+
+def test_delete_then_create_keeps_both():
+    assert steps(entry('delete', at=1), entry('create', at=2, description="x", rollout_percentage=10)) == [
+        ('delete', {}), ('create', {"description": "x", "rollout_percentage": 10})]
+
+def test_updates_of_a_created_flag_are_folded_into_the_create():
+    assert steps(entry('create', at=1, description="x", rollout_percentage=10),
+                 entry('update', at=2, description="y"),
+                 entry('update', at=3, rollout_percentage=30, group=0),
+                 entry('disable', at=4)) == [
+        ('create', {"description": "y", "rollout_percentage": 30, "active": False})]
+
+def test_flags_are_collapsed_separately_in_first_seen_order():
+    plans = collapse([entry('disable', 'b', 1), entry('disable', 'a', 2), entry('enable', 'b', 3)])
+    assert [(plan.key, len(plan.entries)) for plan in plans] == [('b', 2), ('a', 1)]
+
+def test_progress_replaces_the_sent_entries_in_place():
+    entries = [entry('create', 'a', 1), entry('disable', 'b', 2), entry('update', 'a', 3, group=1)]
+    left = [entry('update', 'a', 9, rollout_percentage=5, group=1)]
+    progress = [{"replaced": ["1:a:create:1", "1:a:update:3"], "with": left}]
+    assert replay_progress(entries, progress) == left + [entry('disable', 'b', 2)]
+    assert replay_progress(entries, progress + [{"replaced": ["1:a:update:9"], "with": []}]) == [
+        entry('disable', 'b', 2)]
+
+@pytest.fixture
+def empty_journal(stub):
+    journal.clear()
+    yield stub
+    journal.clear()
+
+def flag(state, key):
+    return [flag for flag in state.projects[1].values() if flag["key"] == key and not flag["deleted"]]
+
+def test_flush_after_a_crash_does_not_send_again(empty_journal):
+    record(1, 'create', 'journal-new', description="New", rollout_percentage=20)
+    record(1, 'disable', 'flag-5')
+    # Dies after the first flag was created, before the second one is sent
+    crash = textwrap.dedent("""
+        import os
+        from ph.utils import journal
+        send = journal.apply_plan
+        def apply_plan(plan, *args):
+            if plan.key == 'flag-5':
+                os._exit(3)
+            return send(plan, *args)
+        journal.apply_plan = apply_plan
+        journal.flush(parallel=1)
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', crash], cwd=root).returncode == 3
+    assert len(flag(empty_journal, 'journal-new')) == 1
+
+    assert [(item["op"], item["key"]) for item in pending()] == [('disable', 'flag-5')]
+    assert journal.flush()
+    assert len(flag(empty_journal, 'journal-new')) == 1
+    assert not flag(empty_journal, 'flag-5')[0]["active"]
+    assert pending() == []
+
+def test_failed_writes_stay_in_the_journal(empty_journal):
+    record(1, 'disable', 'no-such-flag')
+    record(1, 'enable', 'flag-6')
+    assert not journal.flush()
+    assert [(item["op"], item["key"]) for item in pending()] == [('disable', 'no-such-flag')]
+
+def test_error_in_a_later_step_keeps_the_steps_that_went_through(empty_journal, monkeypatch):
+    from ph.utils import flags
+    from ph.utils.client import ConnectionFailed
+    record(1, 'delete', 'flag-9')
+    record(1, 'create', 'flag-9', description="Again", rollout_percentage=10)
+
+    def unreachable(*args, **kwargs):
+        raise ConnectionFailed('POST', 'feature_flags', 'connection refused')
+    monkeypatch.setattr(flags, 'create_flag', unreachable)
+    assert not journal.flush()
+    assert not flag(empty_journal, 'flag-9')
+    assert [(item["op"], item["key"]) for item in pending()] == [('create', 'flag-9')]
+
+    monkeypatch.undo()
+    assert journal.flush()
+    assert flag(empty_journal, 'flag-9')[0]["name"] == "Again"
+    assert pending() == []
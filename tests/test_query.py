@@ -0,0 +1,19 @@
+import pytest
+
+from ph.utils.query import has_limit, is_pageable
+
+@pytest.mark.parametrize("query, pageable", [
+    ("select event, count() from events group by event order by 2 desc", True),
+    ("select * from events", False),
+    ("select * from (select x from t order by x)", False),
+    ("select x, row_number() over (order by x) from t", False),
+    ("select 'order by' from t -- order by x", False),
+    ("select x from t order by x limit 10", False),
+    ("select 1 union all select 2 order by 1", False),
+])
+def test_only_ordered_queries_are_paged(query, pageable):
+    assert is_pageable(query) is pageable
+
+def test_limit_in_a_subquery_is_not_the_query_limit():
+    assert not has_limit("select * from (select x from t limit 5)")
+    assert has_limit("select x from t limit 5")